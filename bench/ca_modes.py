@@ -0,0 +1,67 @@
+'''
+Compare the sampled, synchronous and adaptive cellular automata cave
+modes, on the array and bitboard backends.
+
+Reports the time spent creating caves and generating the whole level,
+together with cave statistics averaged over several seeds per map size,
+the most steps any tunnel took and the cells opened by smoothing and the
+smoothing passes run. For the adaptive mode it also reports
+the mean generations run and the fraction of levels that became stable
+within the time budget.
+
+Usage: python -m bench.ca_modes [--sizes 50x120 100x240] [--seeds 5] [--backends array bitboard] [--budget 0.05]
+'''
+import argparse
+import numpy as np
+from map.ca import CellularAutomata
+
+MODES = ('sampled', 'synchronous', 'adaptive')
+BACKENDS = ('array', 'bitboard')
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Cellular automata cave mode benchmark')
+  parser.add_argument('--sizes', nargs = '+', default = ['50x120', '100x240'], help = 'map sizes as WIDTHxHEIGHT')
+  parser.add_argument('--seeds', type = int, default = 5)
+  parser.add_argument('--backends', nargs = '+', default = list(BACKENDS), choices = BACKENDS)
+  parser.add_argument('--generations', type = int, default = None, help = 'synchronous generations, default derived from iterations')
+  parser.add_argument('--budget', type = float, default = None, help = 'adaptive time budget in seconds')
+  args = parser.parse_args()
+
+  print('{:>9} {:>12} {:>9} {:>10} {:>10} {:>7} {:>7} {:>10} {:>12} {:>9} {:>7} {:>11} {:>7}'.format('size', 'mode', 'backend', 'caves ms', 'level ms', 'caves', 'open', 'mean size', 'max tunnel', 'smoothed', 'passes', 'generations', 'stable'))
+  for size in args.sizes:
+    width, height = (int(v) for v in size.split('x'))
+    for mode, backend in ((m, b) for m in MODES for b in args.backends):
+      caves_time = []
+      level_time = []
+      count = []
+      open_ratio = []
+      cave_size = []
+      tunnel_steps = [0]
+      smoothed = []
+      passes = []
+      generations = []
+      stable = []
+      for seed in range(args.seeds):
+        ca = CellularAutomata(width, height, np.random.default_rng(seed))
+        ca.caveMode = mode
+        ca.backend = backend
+        ca.generations = args.generations
+        if args.budget is not None:
+          ca.timeBudget = args.budget
+        ca.generateLevel()
+        caves_time.append(ca.timings['caves'])
+        level_time.append(sum(ca.timings.values()))
+        count.append(len(ca.caves))
+        open_ratio.append(1.0 - ca.blocked.mean())
+        cave_size.extend(len(c) for c in ca.caves)
+        tunnel_steps.extend(ca.tunnelSteps)
+        smoothed.append(sum(ca.smoothingOpened))
+        passes.append(len(ca.smoothingOpened))
+        if ca.quality is not None:
+          generations.append(ca.quality['generations'])
+          stable.append(ca.quality['stable'])
+      quality = ('{:>11.1f} {:>7.2f}'.format(np.mean(generations), np.mean(stable)) if generations else '{:>11} {:>7}'.format('-', '-'))
+      print('{:>9} {:>12} {:>9} {:>10.2f} {:>10.2f} {:>7.1f} {:>7.3f} {:>10.1f} {:>12} {:>9.1f} {:>7.1f} {}'.format(size, mode, backend, 1000.0*np.mean(caves_time), 1000.0*np.mean(level_time), np.mean(count), np.mean(open_ratio), np.mean(cave_size) if cave_size else 0.0, max(tunnel_steps), np.mean(smoothed), np.mean(passes), quality))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,114 @@
+'''
+Generate stages in bulk across a pool of worker processes, without a window.
+
+Every (seed, stage) pair is generated exactly as the game would, and the
+results are streamed to a stage pack per seed and/or a JSONL summary with
+one line per stage. Throughput is reported in stages per second, overall
+and per worker.
+
+Usage: python -m bench.generate [--seeds 0 1] [--stages 16 116] [--size 50x40] [--workers 4] [--pack stages.pack] [--jsonl stages.jsonl]
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+from map.map import Map, build_layout
+from map.stagepack import PackWriter, encode_stage
+from rng import RNG, parse_seed
+
+PANEL_HEIGHT = 9
+
+def generate(width, height, seed, stage, pack):
+  '''
+  Generate one stage in a worker. Returns the JSONL summary of the stage
+  and, when writing a pack, its record, or None for a stage that is not
+  reproducible from the seed.
+  '''
+  warnings.simplefilter('ignore')
+  start = time.perf_counter()
+  layout = build_layout(width, height, PANEL_HEIGHT, stage, RNG(seed))
+  elapsed = time.perf_counter() - start
+  blocked = layout.blocked()
+  summary = {
+    'seed': seed,
+    'stage': stage,
+    'ms': round(1000.0*elapsed, 3),
+    'caves': int(layout.cave_labels.max()) + 1,
+    'open': round(1.0 - float(blocked.mean()), 4),
+    'spawns': len(layout.spawns),
+    'player': layout.player,
+    'exit': layout.exit,
+    'stable': layout.stable
+  }
+  return summary, encode_stage(layout) if pack and layout.stable else None
+
+# Path of the pack of seed, numbered by seed when there are several
+def pack_path(path, seed, nseeds):
+  if nseeds == 1:
+    return path
+  root, ext = os.path.splitext(path)
+  return '{}-{}{}'.format(root, seed, ext)
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Parallel batch stage generation')
+  parser.add_argument('--seeds', nargs = '+', type = parse_seed, default = [0])
+  parser.add_argument('--stages', nargs = 2, type = int, default = [16, 116], metavar = ('FIRST', 'STOP'), help = 'stages FIRST to STOP - 1')
+  parser.add_argument('--size', default = '50x40', help = 'screen size as WIDTHxHEIGHT, the map is three screens high')
+  parser.add_argument('--workers', type = int, default = os.cpu_count() or 1)
+  parser.add_argument('--chunksize', type = int, default = 4)
+  parser.add_argument('--pack', help = 'stage pack to write, one per seed when there are several')
+  parser.add_argument('--jsonl', help = 'JSONL summary to write, one line per stage')
+  args = parser.parse_args()
+  if args.stages[1] <= args.stages[0]:
+    parser.error('--stages STOP must be greater than FIRST')
+  if len(set(args.seeds)) != len(args.seeds):
+    parser.error('--seeds must not repeat a seed')
+
+  warnings.simplefilter('ignore')
+  width, height = (int(v) for v in args.size.split('x'))
+  stages = range(*args.stages)
+  jobs = [(seed, stage) for seed in args.seeds for stage in stages]
+  pack = args.pack is not None
+
+  writers = {}
+  if pack:
+    game_map = Map(width, height, PANEL_HEIGHT, stages.start, RNG(args.seeds[0]))
+    for seed in args.seeds:
+      writers[seed] = PackWriter(pack_path(args.pack, seed, len(args.seeds)), len(stages), game_map.map_width, game_map.map_height, seed, game_map.generator_version())
+  jsonl = open(args.jsonl, 'w') if args.jsonl is not None else None
+
+  times = []
+  unstable = 0
+  start = time.perf_counter()
+  context = multiprocessing.get_context('spawn')
+  with ProcessPoolExecutor(max_workers = args.workers, mp_context = context) as workers:
+    seeds, stage_numbers = zip(*jobs)
+    results = workers.map(generate, repeat(width), repeat(height), seeds, stage_numbers, repeat(pack), chunksize = args.chunksize)
+    for summary, record in results:
+      times.append(summary['ms'])
+      if record is not None:
+        writers[summary['seed']].add(summary['stage'], record)
+      elif pack:
+        unstable += 1
+      if jsonl is not None:
+        jsonl.write(json.dumps(summary) + '\n')
+  elapsed = time.perf_counter() - start
+
+  for writer in writers.values():
+    writer.close()
+  if jsonl is not None:
+    jsonl.close()
+
+  rate = len(jobs)/elapsed
+  print('{} stages of {}x{} with {} workers in {:.2f} s'.format(len(jobs), width, 3*height, args.workers, elapsed))
+  print('{:.1f} stages/s, {:.1f} stages/s per worker, {:.1f} ms per stage in a worker (median {:.1f})'.format(rate, rate/args.workers, np.mean(times), np.median(times)))
+  if unstable:
+    print('{} stages ran out of time before becoming stable and were left out of the packs'.format(unstable))
+
+if __name__ == '__main__':
+  main()
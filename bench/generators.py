@@ -0,0 +1,49 @@
+'''
+Compare the map generators in map.generators.
+
+Reports, per generator and map size and averaged over several seeds, the
+time to generate a level, the peak memory allocated while doing so, the
+number of caves and the fraction of the map that is open.
+
+Usage: python -m bench.generators [--sizes 50x120 50x240 100x480] [--generators cellular drunkard bsp noise] [--seeds 5]
+'''
+import argparse
+import time
+import tracemalloc
+import numpy as np
+from map.generators import GENERATORS
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Map generator benchmark')
+  parser.add_argument('--sizes', nargs = '+', default = ['50x120', '50x240', '100x480'], help = 'map sizes as WIDTHxHEIGHT')
+  parser.add_argument('--generators', nargs = '+', default = list(GENERATORS), choices = list(GENERATORS))
+  parser.add_argument('--seeds', type = int, default = 5)
+  args = parser.parse_args()
+
+  print('{:>9} {:>10} {:>10} {:>10} {:>7} {:>7}'.format('size', 'generator', 'level ms', 'peak KiB', 'caves', 'open'))
+  for size in args.sizes:
+    width, height = (int(v) for v in size.split('x'))
+    for name in args.generators:
+      level_time = []
+      peak = []
+      count = []
+      open_ratio = []
+      for seed in range(args.seeds):
+        generator = GENERATORS[name](width, height, np.random.default_rng(seed))
+
+        # Time without tracing, then measure memory in a second run
+        start = time.perf_counter()
+        tiles = generator.generateLevel()
+        level_time.append(time.perf_counter() - start)
+        count.append(len(generator.caves))
+        open_ratio.append(1.0 - tiles.blocked.mean())
+
+        generator = GENERATORS[name](width, height, np.random.default_rng(seed))
+        tracemalloc.start()
+        generator.generateLevel()
+        peak.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+      print('{:>9} {:>10} {:>10.2f} {:>10.1f} {:>7.1f} {:>7.3f}'.format(size, name, 1000.0*np.mean(level_time), np.mean(peak)/1024.0, np.mean(count), np.mean(open_ratio)))
+
+if __name__ == '__main__':
+  main()
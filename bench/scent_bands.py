@@ -0,0 +1,50 @@
+'''
+Benchmark the banded scent stencil against band count.
+
+Usage: python -m bench.scent_bands [--width 50] [--heights 120 1200 12000] [--bands 1 2 4 8]
+'''
+import argparse
+import time
+import numpy as np
+from map import scent
+
+def time_step(previous, current, open_mask, nbands, threads, steps):
+  height = previous.shape[1]
+  start = time.perf_counter()
+  for i in range(steps):
+    scent.diffuse_banded(previous, current, open_mask, 1, height - 1, nbands, threads)
+  return (time.perf_counter() - start)/steps
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Banded scent stencil benchmark')
+  parser.add_argument('--width', type = int, default = 50)
+  parser.add_argument('--heights', type = int, nargs = '+', default = [120, 1200, 12000])
+  parser.add_argument('--bands', type = int, nargs = '+', default = [1, 2, 4, 8])
+  parser.add_argument('--threads', type = int, default = scent.physical_cores())
+  parser.add_argument('--steps', type = int, default = 50)
+  parser.add_argument('--seed', type = int, default = 0)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(args.seed)
+  print('physical cores: {}, threads: {}'.format(scent.physical_cores(), args.threads))
+  print('{:>8} {:>6} {:>12} {:>8} {:>10}'.format('height', 'bands', 'ms/step', 'speedup', 'identical'))
+  for height in args.heights:
+    open_mask = rng.random((args.width, height)) < 0.5
+    open_mask[[0, -1], :] = False
+    open_mask[:, [0, -1]] = False
+    previous = (rng.random((args.width, height))*open_mask).astype(np.float32)
+
+    reference = np.zeros_like(previous)
+    scent.diffuse(previous, reference, open_mask)
+
+    base = None
+    for nbands in args.bands:
+      current = np.zeros_like(previous)
+      dt = time_step(previous, current, open_mask, nbands, args.threads, args.steps)
+      if base is None:
+        base = dt
+      identical = np.array_equal(current, reference)
+      print('{:>8} {:>6} {:>12.4f} {:>8.2f} {:>10}'.format(height, nbands, 1000.0*dt, base/dt, str(identical)))
+
+if __name__ == '__main__':
+  main()
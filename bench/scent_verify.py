@@ -0,0 +1,117 @@
+'''
+Check the fast scent kernels against the pure Python reference loop.
+
+A map is generated from a seed, a scripted player path is replayed with
+the camera scrolling up the map, and every scent frame of each kernel is
+compared with the reference. No window is opened.
+
+Usage: python -m bench.scent_verify [--sizes 50x40 100x80] [--kernels dense sparse banded] [--frames 100]
+'''
+import argparse
+import random
+import sys
+import time
+import warnings
+import numpy as np
+from map.map import Map
+from map import scent
+from entity.entity import Entity
+from rng import RNG
+
+PANEL_HEIGHT = 9
+
+# Map settings that select each kernel in Map.update_scent
+KERNELS = {
+  'dense': {'sparse_scent': False, 'min_scent_band_rows': sys.maxsize},
+  'sparse': {'sparse_scent': True, 'sparse_scent_fraction': float('inf'), 'min_scent_band_rows': sys.maxsize},
+  'banded': {'sparse_scent': False, 'min_scent_band_rows': 4, 'scent_threads': max(2, scent.physical_cores())}
+}
+
+def generate(width, height, seed):
+  game_map = Map(width, height, PANEL_HEIGHT, 1, RNG(seed))
+  player = Entity(0, 0, 0, None, 'Player')
+  game_map.generate([player], [], [], Entity(0, 0, 0, None, 'Exit'))
+  return game_map, player
+
+def script_path(game_map, player, frames, seed):
+  '''
+  A random walk over open tiles, with the camera moving up one row every
+  few frames. Returns (x, y, camera_yoffset) per frame.
+  '''
+  rng = random.Random(seed)
+  x, y = player.x, player.y
+  cy = game_map.map_height - game_map.camera_height - 1
+  path = []
+  for frame in range(frames):
+    if frame % 3 == 0:
+      cy = max(0, cy - 1)
+    if frame % 2 == 0:
+      moves = [(x + dx, y + dy) for dx, dy in zip(scent.CARDINAL_DX, scent.CARDINAL_DY) if not game_map.tiles.blocked[x + dx, y + dy]]
+      if moves:
+        x, y = rng.choice(moves)
+    path.append((x, y, cy))
+  return path
+
+def run_reference(game_map, path):
+  width, height = game_map.map_width, game_map.map_height
+  blocked = game_map.tiles.blocked.tolist()
+  previous = [[0.0]*height for x in range(width)]
+  current = [[0.0]*height for x in range(width)]
+  frames = []
+  elapsed = 0.0
+  for x, y, cy in path:
+    start = time.perf_counter()
+    mask = [[not blocked[i][j] and cy <= j < cy + game_map.camera_height for j in range(height)] for i in range(width)]
+    previous[x][y] = scent.PLAYER_SCENT
+    scent.diffuse_reference(previous, current, mask)
+    for i in range(1, width - 1):
+      previous[i][1:-1] = current[i][1:-1]
+    elapsed += time.perf_counter() - start
+    frames.append(np.array(current))
+  return frames, elapsed/len(path)
+
+def run_kernel(game_map, player, path, settings):
+  for name, value in settings.items():
+    setattr(game_map, name, value)
+  max_error = 0.0
+  total_error = 0.0
+  elapsed = 0.0
+  for (x, y, cy), reference in path:
+    player.x, player.y = x, y
+    game_map.camera_yoffset = cy
+    start = time.perf_counter()
+    game_map.update_scent(player)
+    elapsed += time.perf_counter() - start
+    error = np.abs(game_map.tiles.current_scent - reference)
+    max_error = max(max_error, float(error.max()))
+    total_error += float(error.mean())
+  return max_error, total_error/len(path), elapsed/len(path)
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Scent kernel verification and benchmark')
+  parser.add_argument('--sizes', nargs = '+', default = ['50x40', '100x80'], help = 'screen sizes as WIDTHxHEIGHT')
+  parser.add_argument('--kernels', nargs = '+', default = list(KERNELS), choices = list(KERNELS))
+  parser.add_argument('--frames', type = int, default = 100)
+  parser.add_argument('--seed', type = int, default = 0)
+  parser.add_argument('--tolerance', type = float, default = 1.0e-3)
+  args = parser.parse_args()
+
+  warnings.simplefilter('ignore')
+  failed = False
+  print('{:>8} {:>8} {:>12} {:>12} {:>10} {:>10} {:>8}'.format('size', 'kernel', 'max err', 'mean err', 'ref ms', 'ms', 'speedup'))
+  for size in args.sizes:
+    width, height = (int(v) for v in size.split('x'))
+    game_map, player = generate(width, height, args.seed)
+    path = script_path(game_map, player, args.frames, args.seed)
+    frames, reference_time = run_reference(game_map, path)
+
+    for kernel in args.kernels:
+      game_map, player = generate(width, height, args.seed)
+      max_error, mean_error, kernel_time = run_kernel(game_map, player, list(zip(path, frames)), KERNELS[kernel])
+      failed = failed or max_error > args.tolerance
+      print('{:>8} {:>8} {:>12.3e} {:>12.3e} {:>10.3f} {:>10.3f} {:>8.1f}'.format(size, kernel, max_error, mean_error, 1000.0*reference_time, 1000.0*kernel_time, reference_time/kernel_time))
+
+  return 1 if failed else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
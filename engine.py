@@ -1,13 +1,17 @@
 import tcod as libtcod
 
 import time
-from random import randint
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from constants import StatusType, CharType, ScorecardType
 from client import Client
 from entity.entity import Entity
 from entity.stats import Stats
 from entity.ai import AI
-from map.map import Map
+from map.map import Map, build_layout
+from map.cache import LevelCache
+from map.stagepack import StagePack
+from rng import RNG
 from log import Log
 from menu import Menu
 from handlers import handle_keys
@@ -15,7 +19,12 @@ from handlers import handle_keys
 LEVEL_START = 16
 
 class Engine:
-  def __init__(self, screen_width = 50, screen_height = 40):
+  def __init__(self, screen_width = 50, screen_height = 40, seed = None, cache_dir = None, stage_pack = None):
+    # When ENTER started a run and the time taken to set up its first stage,
+    # to report how long the player waited for the first frame
+    self.enter_time = None
+    self.first_stage_time = None
+
     # Define flag to display menu
     self.state = 'menu'
 
@@ -29,6 +38,22 @@ class Engine:
     # Define stage number
     self.stage = LEVEL_START
 
+    # Random streams for every stage of a run, derived from seed, or from a
+    # new seed for each run when it is None. The streams of the next run are
+    # made while the menu is shown, so its first stage can be built there.
+    # Stages are opened from a memory-mapped stage pack when given one, which
+    # also supplies the seed
+    self.stage_pack = StagePack(stage_pack) if stage_pack is not None else None
+    if self.stage_pack is not None and seed is None:
+      seed = self.stage_pack.seed
+
+    self.seed = seed
+    self.rng = RNG(self.seed)
+
+    # Stages are read back from an on-disk cache when given a directory for it,
+    # which pays off with a fixed seed
+    self.level_cache = LevelCache(cache_dir) if cache_dir is not None else None
+
     # Define message log and status panel
     self.bar_width = 15
     self.panel_yoffset = self.screen_height - self.panel_height + 1
@@ -69,7 +94,14 @@ class Engine:
 
     # Create map
     self.next_stage = False
-    self.map = Map(self.screen_width, self.screen_height, self.panel_height, self.stage)
+    self.scent_overlay = False
+    self.map = Map(self.screen_width, self.screen_height, self.panel_height, self.stage, self.rng)
+
+    # The next stage is generated by a worker process while the current one
+    # is played, pending holds (seed, stage, future) for the layout being built
+    self.pregenerate = True
+    self.workers = None
+    self.pending = None
 
     # Initialize the root console
     libtcod.console_init_root(self.screen_width, self.screen_height, 'rogue-dash (2021 7DRL)', False)
@@ -125,14 +157,69 @@ class Engine:
     self.items = []
     self.equips = []
     self.exit = Entity(0, 0, CharType.STAIRS_DOWN, libtcod.white, 'Exit', blocks = False)
-    self.map = Map(self.screen_width, self.screen_height, self.panel_height, self.stage)
-    self.map.generate(self.entities, self.items, self.equips, self.exit)
+    self.map = Map(self.screen_width, self.screen_height, self.panel_height, self.stage, self.rng)
+    self.map.scent_overlay = self.scent_overlay
+    self.map.cache = self.level_cache
+    layout = self.packed_layout(self.stage)
+    if layout is None:
+      layout = self.pregenerated_layout(self.stage)
+    if layout is not None:
+      self.map.load(layout, self.entities, self.items, self.equips, self.exit)
+    else:
+      self.map.generate(self.entities, self.items, self.equips, self.exit)
+    self.start_pregeneration(self.stage + 1)
     if reset:
       self.log.clear()
       self.log.add('Welcome to rogue-dash!', libtcod.green)
     else:
       self.log.add("Welcome to stage {}!".format(self.stage), libtcod.green)
 
+  # Start generating the layout of stage in a worker process
+  def start_pregeneration(self, stage):
+    if self.pending is not None:
+      self.pending[2].cancel()
+    self.pending = None
+    if not self.pregenerate or self.packed_layout(stage, check = True):
+      return
+    try:
+      if self.workers is None:
+        self.workers = ProcessPoolExecutor(max_workers = 1, mp_context = multiprocessing.get_context('spawn'))
+      future = self.workers.submit(build_layout, self.screen_width, self.screen_height, self.panel_height, stage, self.rng, self.level_cache)
+      self.pending = (self.rng.seed, stage, future)
+    except Exception:
+      # Generate synchronously from now on
+      self.pregenerate = False
+
+  # The layout of stage from the stage pack, if it holds that stage as this run
+  # would generate it, or with check just whether it does
+  def packed_layout(self, stage, check = False):
+    pack = self.stage_pack
+    if pack is None or pack.seed != self.rng.seed or stage not in pack:
+      return None
+    if (pack.width, pack.height) != (self.map.map_width, self.map.map_height) or pack.generator_version != self.map.generator_version():
+      return None
+    return True if check else pack.layout(stage)
+
+  # The layout of stage if a worker has built it or is building it, waiting
+  # for it in that case as that is never slower than starting over, or None
+  # to generate it here. Both give the same stage, as it only depends on the
+  # seed and stage number.
+  def pregenerated_layout(self, stage):
+    if self.pending is None:
+      return None
+    seed, pending_stage, future = self.pending
+    self.pending = None
+    if seed != self.rng.seed or pending_stage != stage:
+      future.cancel()
+      return None
+    if future.cancel():
+      # The worker had not started on it yet
+      return None
+    try:
+      return future.result()
+    except Exception:
+      return None
+
   # Update all entities and the map
   def update(self, dt):
     status = StatusType.OK
@@ -141,12 +228,22 @@ class Engine:
     if self.key.vk == libtcod.KEY_DELETE:
       libtcod.console_set_fullscreen(not libtcod.console_is_fullscreen())
 
+    if self.key.vk == libtcod.KEY_F1:
+      self.scent_overlay = not self.scent_overlay
+      self.map.scent_overlay = self.scent_overlay
+
     if self.state == 'menu':
       self.menu.update(self.record)
 
+      # Build the first stage of the next run in the background while idle
+      if self.pending is None or self.pending[:2] != (self.rng.seed, LEVEL_START):
+        self.start_pregeneration(LEVEL_START)
+
       if self.key.vk == libtcod.KEY_ENTER:
         self.state = 'game'
+        self.enter_time = time.perf_counter()
         self.generateStage(reset = True)
+        self.first_stage_time = time.perf_counter() - self.enter_time
         status = StatusType.DIED
       elif self.key.vk == libtcod.KEY_ESCAPE:
         status = StatusType.QUIT
@@ -167,6 +264,7 @@ class Engine:
       if status == StatusType.DIED:
         self.render()
         self.state = 'menu'
+        self.rng = RNG(self.seed)
 
     return status
 
@@ -230,6 +328,13 @@ class Engine:
       # Flush buffer to the root console
       libtcod.console_flush()
 
+      # Report how long the first frame of the run took to show up
+      if self.enter_time is not None:
+        latency = time.perf_counter() - self.enter_time
+        self.log.add('Stage set up in {:.0f} ms, playable {:.0f} ms after ENTER'.format(1000.0*self.first_stage_time, 1000.0*latency), libtcod.light_grey)
+        self.enter_time = None
+        self.first_stage_time = None
+
       # Clear all entities
       for entity in self.entities:
         entity.clear(self.con, self.map.camera_yoffset)
@@ -1,4 +1,3 @@
-from random import randint
 import tcod as libtcod
 from handlers import handle_keys
 from constants import StatusType, CharType
@@ -97,16 +96,11 @@ class AI:
     if d == 1:
       return owner.attack(engine.player, engine)
     else:
-      # Search for the largest scent in cardinal direction *only*
-      iz = -1
-      scentMax = -1.0
+      # Look up the largest scent in cardinal direction *only*, as published by the map
       dx = ( 0, -1, 0, 1)
       dy = (-1,  0, 1, 0)
-      for z in range(4):
-        scent = engine.map.tiles[owner.x + dx[z]][owner.y + dy[z]].current_scent
-        if scent > scentMax:
-          scentMax = scent
-          iz = z
+      iz = int(engine.map.scent_direction[owner.x, owner.y])
+      scentMax = engine.map.scent_max[owner.x, owner.y]
 
       # If scent is less then creature's threshold, ignore
       if scentMax <= self.scent_threshold:
@@ -118,8 +112,8 @@ class AI:
         dest_y = owner.y + dy[iz]
       else:
         iz = 0
-        dx = (randint(-1, 1),)
-        dy = (randint(-1, 1),)
+        dx = (int(engine.map.ai_rng.integers(-1, 2)),)
+        dy = (int(engine.map.ai_rng.integers(-1, 2)),)
         dest_x = owner.x + dx[iz]
         dest_y = owner.y + dy[iz]
 
@@ -1,4 +1,3 @@
-from random import uniform
 import tcod as libtcod
 from constants import StatusType, CharType
 
@@ -32,7 +31,7 @@ class Entity:
 
   def attack(self, target, engine):
     if target.is_dead() == False:
-      damage = int(self.stats.ap * uniform(1.0, 1.125) - target.stats.dp)
+      damage = int(self.stats.ap * engine.map.combat_rng.uniform(1.0, 1.125) - target.stats.dp)
       if damage > 0:
         engine.log.add("{} attacks {} for {} damage".format(self.name, target.name, damage), libtcod.light_grey)
       else:
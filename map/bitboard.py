@@ -0,0 +1,135 @@
+class BitBoard:
+  '''
+  A blocked mask stored as one Python int per row, bit x of rows[y] being
+  set when cell (x, y) is blocked. Neighbour counts are computed for a
+  whole row at once with shifts and bitwise adders, so it needs no NumPy.
+  '''
+  def __init__(self, width, height, blocked = True):
+    self.width = width
+    self.height = height
+    self.full = (1 << width) - 1
+    self.rows = [self.full if blocked else 0 for y in range(height)]
+
+  def __getitem__(self, key):
+    x, y = key
+    return (self.rows[y] >> x) & 1 == 1
+
+  def __setitem__(self, key, value):
+    x, y = key
+    if value:
+      self.rows[y] |= 1 << x
+    else:
+      self.rows[y] &= ~(1 << x)
+
+  # Set or clear cells [x0, x1) on row y
+  def setSpan(self, x0, x1, y, value):
+    bits = (1 << x1) - (1 << x0)
+    if value:
+      self.rows[y] |= bits
+    else:
+      self.rows[y] &= ~bits
+
+  # Block the outer ring of cells
+  def seal(self):
+    edges = 1 | (1 << (self.width - 1))
+    self.rows[0] = self.full
+    self.rows[-1] = self.full
+    for y in range(1, self.height - 1):
+      self.rows[y] |= edges
+
+  def count(self):
+    return sum(bin(row).count('1') for row in self.rows)
+
+  # Number of walls in 8 directions around (x, y)
+  def adjacentWalls(self, x, y):
+    walls = bin((self.rows[y - 1] >> (x - 1)) & 7).count('1')
+    walls += bin((self.rows[y] >> (x - 1)) & 5).count('1')
+    walls += bin((self.rows[y + 1] >> (x - 1)) & 7).count('1')
+    return walls
+
+  def neighbours(self, y, diagonals):
+    # The rows of neighbours of row y, as bit planes aligned with it
+    up, row, down = self.rows[y - 1], self.rows[y], self.rows[y + 1]
+    planes = [up, down, (row << 1) & self.full, row >> 1]
+    if diagonals:
+      planes += [(up << 1) & self.full, up >> 1, (down << 1) & self.full, down >> 1]
+    return planes
+
+  def counts(self, planes):
+    '''
+    Add up one bit planes into a bit-sliced counter and return, for every
+    possible count k, the mask of cells where the count equals k.
+    '''
+    counter = [0, 0, 0, 0]
+    for carry in planes:
+      for i in range(len(counter)):
+        counter[i], carry = counter[i] ^ carry, counter[i] & carry
+        if not carry:
+          break
+
+    masks = []
+    for k in range(len(planes) + 1):
+      mask = self.full
+      for i in range(len(counter)):
+        mask &= counter[i] if (k >> i) & 1 else ~counter[i]
+      masks.append(mask)
+    return masks
+
+  def step(self, neighbors, x0, x1, y0, y1):
+    '''
+    Apply one synchronous generation of the cave rule to cells [x0, x1) on
+    rows [y0, y1): more than neighbors walls in 8 directions makes a wall,
+    fewer makes an open cell. Returns the number of cells changed.
+    '''
+    region = (1 << x1) - (1 << x0)
+    rows = list(self.rows)
+    changed = 0
+    for y in range(y0, y1):
+      masks = self.counts(self.neighbours(y, True))
+      walls = 0
+      opens = 0
+      for k, mask in enumerate(masks):
+        if k > neighbors:
+          walls |= mask
+        elif k < neighbors:
+          opens |= mask
+      rows[y] = (rows[y] | (walls & region)) & ~(opens & region)
+      changed += bin(rows[y] ^ self.rows[y]).count('1')
+    self.rows = rows
+    return changed
+
+  def smooth(self, smoothing, x0, x1, y0, y1):
+    '''
+    Open, in one synchronous pass, every wall cell in [x0, x1) on rows
+    [y0, y1) with at most smoothing walls in four directions. Returns the
+    number of cells opened.
+    '''
+    region = (1 << x1) - (1 << x0)
+    rows = list(self.rows)
+    opened = 0
+    for y in range(y0, y1):
+      masks = self.counts(self.neighbours(y, False))
+      few = 0
+      for mask in masks[:smoothing + 1]:
+        few |= mask
+      cells = few & region & self.rows[y]
+      rows[y] &= ~cells
+      opened += bin(cells).count('1')
+    self.rows = rows
+    return opened
+
+  # Runs of open cells, as (y, start, end) with cells [start, end) open on row y
+  def runs(self):
+    runs = []
+    for y, row in enumerate(self.rows):
+      cells = ~row & self.full
+      while cells:
+        low = cells & -cells
+        carried = cells + low
+        runs.append((y, low.bit_length() - 1, (carried & ~cells).bit_length() - 1))
+        cells &= carried
+    return runs
+
+  # The mask as a list of columns, indexed [x][y] like a TileGrid
+  def columns(self):
+    return [[(row >> x) & 1 == 1 for row in self.rows] for x in range(self.width)]
@@ -1,18 +1,57 @@
+import heapq
 import math
 import random
-from map.tile import Tile
+import time
+from map.bitboard import BitBoard
+try:
+  import numpy as np
+  from map.tile import TileGrid
+except ImportError:
+  np = None
+
+# Root of i in the union-find forest parent, halving the path on the way
+def findRoot(parent, i):
+  while parent[i] != i:
+    parent[i] = parent[parent[i]]
+    i = parent[i]
+  return i
 
 class CellularAutomata:
   '''
   Andy Stobirski's cellular automata algorithm from Grid Sage Games blog.
+  This is the reference map generator, see map.generators for the others.
+
+  Random numbers are drawn in bulk from rng, a NumPy Generator or, where
+  NumPy is missing, a random.Random, so a level is reproducible from the
+  seed of rng.
   '''
-  def __init__(self, mapWidth, mapHeight):
+  def __init__(self, mapWidth, mapHeight, rng = None):
     self.mapWidth = mapWidth
     self.mapHeight = mapHeight
+    if rng is None:
+      rng = np.random.default_rng() if np is not None else random.Random()
+    self.rng = rng
 
     # Number of iterations when creating caves
     self.iterations = 30000
 
+    # How the cellular automata rules are applied: 'sampled' updates one random
+    # cell at a time for self.iterations, 'synchronous' updates every cell at
+    # once for self.generations (by default the iterations per interior cell)
+    # and 'adaptive' updates every cell at once until the level is stable
+    self.caveMode = 'sampled'
+    self.generations = None
+
+    # In 'adaptive' mode generations are applied until at most stableFraction
+    # of the interior cells change in one, for at most maxGenerations or until
+    # timeBudget seconds have passed since generateLevel started
+    self.stableFraction = 0.001
+    self.maxGenerations = 50
+    self.timeBudget = 0.05
+
+    # Generations run and stability reached by the last 'adaptive' level
+    self.quality = None
+
     # Number of neighboring walls for this cell to become a wall
     self.neighbors = 4
 
@@ -25,89 +64,249 @@ class CellularAutomata:
     # Size in total number of cells, not dimensions
     self.ROOM_MAX_SIZE = 500
 
-    self.smoothEdges = True
-    self.smoothing =  1
-
-  # Generate a map
-  def generateLevel(self):
-    self.caves = []
-    self.tiles = [[Tile() for y in range(self.mapHeight)] for x in range(self.mapWidth)]
-
-    # Start with randomly filled map
-    self.randomFillMap()
-    
-    # Apply cellular automata rules iteratively
-    self.createCaves()
+    # How caves are connected: 'closest' tunnels from every cave to the closest
+    # later cave, 'mst' carves the shortest tunnels that join all caves
+    self.connectMode = 'closest'
 
-    # Create a cavity where the player will start
-    self.createCavity()
+    # How tunnels are carved by createTunnel: 'walk' is a weighted random walk,
+    # finished with a line after tunnelStepLimit steps per cell of distance,
+    # 'line' a noisy line and 'astar' the cheapest path through rock
+    self.tunnelMode = 'walk'
+    self.tunnelStepLimit = 20
 
-    # Locate all the isolated caves, discarding small and large caves
-    self.getCaves()
+    # How the blocked mask is stored while generating: 'array' is a NumPy
+    # array, 'bitboard' one Python int per row, which works without NumPy
+    self.backend = 'array' if np is not None else 'bitboard'
 
-    # Connect caves via tunnels
-    self.connectCaves()
+    self.smoothEdges = True
+    self.smoothing =  1
+    self.smoothingPasses = 5
 
-    # Clean up map by smoothing endges
-    self.cleanUpMap()
+  # Every setting that changes the levels generated
+  def settings(self):
+    return (self.iterations, self.caveMode, self.generations, self.neighbors, self.wallProbability, self.ROOM_MIN_SIZE,
+      self.connectMode, self.tunnelMode, self.tunnelStepLimit, self.smoothEdges, self.smoothing, self.smoothingPasses,
+      self.stableFraction, self.maxGenerations, self.timeBudget)
 
+  # Generate a map, returning a TileGrid, or the BitBoard when NumPy is missing
+  def generateLevel(self):
+    self.startTime = time.perf_counter()
+    self.quality = None
+    self.caves = []
+    if self.backend == 'bitboard':
+      self.tiles = None
+      self.blocked = BitBoard(self.mapWidth, self.mapHeight)
+    else:
+      self.tiles = TileGrid(self.mapWidth, self.mapHeight)
+      self.blocked = self.tiles.blocked
+
+    # Seconds spent in each phase, and steps taken to carve each tunnel
+    self.timings = {}
+    self.tunnelSteps = []
+
+    phases = (
+      # Start with randomly filled map
+      ('fill', self.randomFillMap),
+      # Apply cellular automata rules iteratively
+      ('caves', self.createCaves),
+      # Create a cavity where the player will start
+      ('cavity', self.createCavity),
+      # Locate all the isolated caves, discarding small and large caves
+      ('label', self.getCaves),
+      # Connect caves via tunnels
+      ('connect', self.connectCaves),
+      # Clean up map by smoothing endges
+      ('smooth', self.cleanUpMap)
+    )
+    for name, phase in phases:
+      start = time.perf_counter()
+      phase()
+      self.timings[name] = time.perf_counter() - start
+
+    if self.backend == 'bitboard':
+      if np is None:
+        return self.blocked
+      self.tiles = TileGrid(self.mapWidth, self.mapHeight)
+      self.tiles.blocked[:] = self.blocked.columns()
+      self.blocked = self.tiles.blocked
     return self.tiles
 
   def sealLevel(self):
-    y = 0
-    for x in range(self.mapWidth):
-      self.tiles[x][y].blocked = True
-    y = self.mapHeight - 1
-    for x in range(self.mapWidth):
-      self.tiles[x][y].blocked = True
-    x = 0
-    for y in range(self.mapHeight):
-      self.tiles[x][y].blocked = True
-    x = self.mapWidth - 1
-    for y in range(self.mapHeight):
-      self.tiles[x][y].blocked = True
-
-  # Randomly populate map
+    if self.backend == 'bitboard':
+      self.blocked.seal()
+      return
+    self.blocked[:, 0] = True
+    self.blocked[:, self.mapHeight - 1] = True
+    self.blocked[0, :] = True
+    self.blocked[self.mapWidth - 1, :] = True
+
+  # n uniform draws in [0, 1) from self.rng, as a list
+  def draws(self, n):
+    if isinstance(self.rng, random.Random):
+      return [self.rng.random() for i in range(n)]
+    return self.rng.random(n).tolist()
+
+  # n integers in [low, high) from self.rng, as a list
+  def integers(self, low, high, n):
+    if isinstance(self.rng, random.Random):
+      return [self.rng.randrange(low, high) for i in range(n)]
+    return self.rng.integers(low, high, n).tolist()
+
+  # Randomly populate map, from one draw per interior cell in row order
   def randomFillMap(self):
-    for y in range(2, self.mapHeight - 2):
-      for x in range(2, self.mapWidth - 2):
-        if random.random() >= self.wallProbability:
-          self.tiles[x][y].blocked = False
+    width = self.mapWidth - 4
+    if self.backend == 'bitboard':
+      draws = self.draws(width*(self.mapHeight - 4))
+      for y in range(2, self.mapHeight - 2):
+        row = draws[(y - 2)*width:(y - 1)*width]
+        opened = sum(1 << x for x, d in enumerate(row, 2) if d >= self.wallProbability)
+        self.blocked.rows[y] &= ~opened
+    else:
+      if isinstance(self.rng, random.Random):
+        fill = np.reshape(self.draws(width*(self.mapHeight - 4)), (self.mapHeight - 4, width))
+      else:
+        fill = self.rng.random((self.mapHeight - 4, width))
+      self.blocked[2:-2, 2:-2][fill.T >= self.wallProbability] = False
 
     self.sealLevel()
 
   def createCaves(self):
-    for i in range(self.iterations):
-      # Pick a random point with a buffer around the edges of the map
-      x = random.randint(2, self.mapWidth - 3)
-      y = random.randint(2, self.mapHeight - 3)
-
+    if self.caveMode == 'synchronous':
+      self.createCavesSynchronous()
+      return
+
+    if self.caveMode == 'adaptive':
+      self.createCavesAdaptive()
+      return
+
+    # Pick random points with a buffer around the edges of the map
+    xs = self.integers(2, self.mapWidth - 2, self.iterations)
+    ys = self.integers(2, self.mapHeight - 2, self.iterations)
+    for x, y in zip(xs, ys):
       # If the cell's neighboring walls > self.neighbors, set blocked to true
-      if self.getAdjacentWalls(x,y) > self.neighbors:
-        self.tiles[x][y].blocked = True
+      walls = self.getAdjacentWalls(x,y)
+      if walls > self.neighbors:
+        self.blocked[x, y] = True
       # Or set blocked to false
-      elif self.getAdjacentWalls(x,y) < self.neighbors:
-        self.tiles[x][y].blocked = False
+      elif walls < self.neighbors:
+        self.blocked[x, y] = False
 
     self.sealLevel()
 
+  # Apply the cellular automata rules to every interior cell at once
+  def createCavesSynchronous(self):
+    generations = self.generations
+    if generations is None:
+      generations = max(1, round(self.iterations / ((self.mapWidth - 4)*(self.mapHeight - 4))))
+
+    if self.backend == 'bitboard':
+      for i in range(generations):
+        self.blocked.step(self.neighbors, 2, self.mapWidth - 2, 2, self.mapHeight - 2)
+      self.sealLevel()
+      return
+
+    inner = self.blocked[2:-2, 2:-2]
+    for i in range(generations):
+      walls = self.countAdjacentWalls()[1:-1, 1:-1]
+      inner[walls > self.neighbors] = True
+      inner[walls < self.neighbors] = False
+
+    self.sealLevel()
+
+  def createCavesAdaptive(self):
+    '''
+    Apply the cellular automata rules to every interior cell at once until
+    the level is stable, so the work grows with the map area and with how
+    far the fill is from settling, within self.timeBudget.
+
+    self.quality holds the generations run, the fraction of interior cells
+    changed by the last one and whether that met self.stableFraction. A
+    level cut short by the budget depends on the speed of the machine, so
+    only stable levels are reproducible from the seed.
+    '''
+    cells = (self.mapWidth - 4)*(self.mapHeight - 4)
+    changed = 1.0
+    generations = 0
+    while generations < self.maxGenerations:
+      if self.backend == 'bitboard':
+        count = self.blocked.step(self.neighbors, 2, self.mapWidth - 2, 2, self.mapHeight - 2)
+      else:
+        inner = self.blocked[2:-2, 2:-2]
+        walls = self.countAdjacentWalls()[1:-1, 1:-1]
+        grow = ~inner & (walls > self.neighbors)
+        erode = inner & (walls < self.neighbors)
+        count = int(np.count_nonzero(grow)) + int(np.count_nonzero(erode))
+        inner[grow] = True
+        inner[erode] = False
+      generations += 1
+      changed = count / cells
+      if changed <= self.stableFraction or time.perf_counter() - self.startTime >= self.timeBudget:
+        break
+
+    self.quality = {'generations': generations, 'changed': changed, 'stable': changed <= self.stableFraction}
+    self.sealLevel()
+
+  # Number of walls in 8 directions for every cell, excluding the outer ring
+  def countAdjacentWalls(self):
+    blocked = self.blocked.view(np.uint8)
+    walls = np.zeros((self.mapWidth - 2, self.mapHeight - 2), dtype = np.uint8)
+    for dx in (-1, 0, 1):
+      for dy in (-1, 0, 1):
+        if dx != 0 or dy != 0:
+          walls += blocked[1 + dx:self.mapWidth - 1 + dx, 1 + dy:self.mapHeight - 1 + dy]
+    return walls
+
   # Clean Up Map
   def cleanUpMap(self):
-    if self.smoothEdges:
-      for i in range(5):
-        # Look at each cell individually and check for smoothness
-        for x in range(2, self.mapWidth - 2):
-          for y in range(2, self.mapHeight - 2):
-            if (self.tiles[x][y].blocked == True) and (self.getAdjacentWallsSimple(x,y) <= self.smoothing):
-              self.tiles[x][y].blocked = False
-
-  # Create a tunnel from offset to end_offset using a heavily weighted random walk
+    '''
+    Open every wall cell with at most self.smoothing walls in four
+    directions, for up to self.smoothingPasses passes over the whole grid,
+    stopping early once a pass opens nothing. self.smoothingOpened holds
+    the number of cells opened by each pass.
+    '''
+    self.smoothingOpened = []
+    if self.smoothEdges and self.backend == 'bitboard':
+      for i in range(self.smoothingPasses):
+        count = self.blocked.smooth(self.smoothing, 2, self.mapWidth - 2, 2, self.mapHeight - 2)
+        self.smoothingOpened.append(count)
+        if count == 0:
+          break
+    elif self.smoothEdges:
+      inner = self.blocked[2:-2, 2:-2]
+      for i in range(self.smoothingPasses):
+        opened = inner & (self.countAdjacentWallsSimple()[1:-1, 1:-1] <= self.smoothing)
+        count = int(np.count_nonzero(opened))
+        self.smoothingOpened.append(count)
+        if count == 0:
+          break
+        inner[opened] = False
+
+  # Create a tunnel from offset into endCave, a set of offsets, heading for
+  # end_offset, and record the number of steps it took
   def createTunnel(self,offset,end_offset,endCave):
+    if self.tunnelMode == 'astar':
+      steps = self.carveAStar(offset,end_offset,endCave)
+    elif self.tunnelMode == 'line':
+      steps = self.carveLine(offset,end_offset,endCave)
+    else:
+      steps = self.carveWalk(offset,end_offset,endCave)
+    self.tunnelSteps.append(steps)
+
+  # Carve using a heavily weighted random walk, finishing with a line once it
+  # has taken more than tunnelStepLimit steps per cell of distance
+  def carveWalk(self,offset,end_offset,endCave):
     x_end = end_offset % self.mapWidth
     y_end = end_offset // self.mapWidth
     x = offset % self.mapWidth
     y = offset // self.mapWidth
+    limit = self.tunnelStepLimit*(abs(x_end - x) + abs(y_end - y))
+    choices = self.draws(limit)
+    steps = 0
     while offset not in endCave:
+      if steps >= limit:
+        return steps + self.carveLine(offset,end_offset,endCave)
+      steps += 1
+
       # Choose Direction
       north = 1.0
       south = 1.0
@@ -134,7 +333,7 @@ class CellularAutomata:
       west /= total
 
       # Choose the direction
-      choice = random.random()
+      choice = choices[steps - 1]
       if 0 <= choice < north:
         dx = 0
         dy = -1
@@ -153,8 +352,63 @@ class CellularAutomata:
         x += dx
         y += dy
         offset = x + self.mapWidth*y
-        if self.tiles[x][y].blocked == True:
-          self.tiles[x][y].blocked = False
+        self.blocked[x, y] = False
+
+    return steps
+
+  # Carve a 4-connected line that takes a random axis step towards end_offset,
+  # weighted by the distance left on each axis, so it takes at most the
+  # Manhattan distance in steps
+  def carveLine(self,offset,end_offset,endCave):
+    x_end = end_offset % self.mapWidth
+    y_end = end_offset // self.mapWidth
+    x = offset % self.mapWidth
+    y = offset // self.mapWidth
+    choices = self.draws(abs(x_end - x) + abs(y_end - y))
+    steps = 0
+    while offset not in endCave and (x != x_end or y != y_end):
+      if choices[steps]*(abs(x_end - x) + abs(y_end - y)) < abs(x_end - x):
+        x += 1 if x_end > x else -1
+      else:
+        y += 1 if y_end > y else -1
+      offset = x + self.mapWidth*y
+      self.blocked[x, y] = False
+      steps += 1
+    return steps
+
+  # Carve the cheapest path into endCave, where rock costs more to dig through
+  # than open cells, searching towards end_offset with A*
+  def carveAStar(self,offset,end_offset,endCave):
+    x_end = end_offset % self.mapWidth
+    y_end = end_offset // self.mapWidth
+    openCost = 0.25
+    cost = {offset: 0.0}
+    previous = {offset: None}
+    heap = [(0.0, offset)]
+    while heap:
+      f, current = heapq.heappop(heap)
+      if current in endCave:
+        break
+      x = current % self.mapWidth
+      y = current // self.mapWidth
+      for dx, dy in ((0, -1), (0, 1), (1, 0), (-1, 0)):
+        xn = x + dx
+        yn = y + dy
+        if 0 < xn < self.mapWidth - 1 and 0 < yn < self.mapHeight - 1:
+          nxt = xn + self.mapWidth*yn
+          c = cost[current] + (1.0 if self.blocked[xn, yn] else openCost)
+          if c < cost.get(nxt, math.inf):
+            cost[nxt] = c
+            previous[nxt] = current
+            heapq.heappush(heap, (c + openCost*(abs(x_end - xn) + abs(y_end - yn)), nxt))
+
+    # Open the path back to the start
+    steps = 0
+    while previous[current] is not None:
+      self.blocked[current % self.mapWidth, current // self.mapWidth] = False
+      current = previous[current]
+      steps += 1
+    return steps
 
   # Create a cavity where the player will start
   def createCavity(self):
@@ -162,94 +416,178 @@ class CellularAutomata:
     hmax = 7
 
     # Fill in the region first
-    for h in range(hmax):
-      y = self.mapHeight - 2 - h
-      for x in range(self.mapWidth):
-        self.tiles[x][y].blocked = True
+    if self.backend == 'bitboard':
+      for y in range(self.mapHeight - 1 - hmax, self.mapHeight - 1):
+        self.blocked.setSpan(0, self.mapWidth, y, True)
+    else:
+      self.blocked[:, self.mapHeight - 1 - hmax:self.mapHeight - 1] = True
 
     # Excavate starting location
     for h in range(hmax):
       y = self.mapHeight - 2 - h
       xmin = 1 + self.mapWidth // 4 + (hmax // 2 - h)
       xmax = 3 * self.mapWidth // 4 - 1 - (hmax // 2 - h)
-      for x in range(xmin, xmax):
-        self.tiles[x][y].blocked = False
+      if self.backend == 'bitboard':
+        if xmin < xmax:
+          self.blocked.setSpan(xmin, xmax, y, False)
+      else:
+        self.blocked[xmin:xmax, y] = False
 
     self.sealLevel()
 
+  # Number of walls in four directions for every cell, excluding the outer ring
+  def countAdjacentWallsSimple(self):
+    blocked = self.blocked.view(np.uint8)
+    walls = blocked[1:-1, :-2] + blocked[1:-1, 2:]
+    walls += blocked[:-2, 1:-1]
+    walls += blocked[2:, 1:-1]
+    return walls
+
   # Finds the walls in four directions
   def getAdjacentWallsSimple(self, x, y):
-    wallCounter = 0
-    if (self.tiles[x][y-1].blocked == True): # Check north
-      wallCounter += 1
-    if (self.tiles[x][y+1].blocked == True): # Check south
-      wallCounter += 1
-    if (self.tiles[x-1][y].blocked == True): # Check west
-      wallCounter += 1
-    if (self.tiles[x+1][y].blocked == True): # Check east
-      wallCounter += 1
-
-    return wallCounter
+    blocked = self.blocked
+    # North, south, west and east
+    return int(blocked[x, y-1]) + int(blocked[x, y+1]) + int(blocked[x-1, y]) + int(blocked[x+1, y])
 
   # Finds the walls in 8 directions
   def getAdjacentWalls(self, tileX, tileY):
-    wallCounter = 0
-    for x in range(tileX-1, tileX+2):
-      for y in range(tileY-1, tileY+2):
-        if self.tiles[x][y].blocked == True:
-          # Exclude reference location
-          if (x != tileX) or (y != tileY):
-            wallCounter += 1
+    if self.backend == 'bitboard':
+      return self.blocked.adjacentWalls(tileX, tileY)
+
+    # Count the 3x3 block, excluding the reference location
+    wallCounter = np.count_nonzero(self.blocked[tileX-1:tileX+2, tileY-1:tileY+2])
+    if self.blocked[tileX, tileY]:
+      wallCounter -= 1
     return wallCounter
 
   # Locate all the caves within self.tiles and store them in self.caves
   def getCaves(self):
-    for x in range(self.mapWidth):
-      for y in range(self.mapHeight):
-        if self.tiles[x][y].blocked == False:
-          self.floodFill(x,y)
-
-    for cave in self.caves:
-      for offset in cave:
-        xp = offset % self.mapWidth
-        yp = offset // self.mapWidth
-        if xp >= 1 and xp <= self.mapWidth - 2 and yp >= 1 and yp <= self.mapHeight - 2:
-          self.tiles[xp][yp].blocked = False
-
-  def floodFill(self,x,y):
     '''
-    Flood fill the separate regions of the level, discard
-    the regions that are smaller than a minimum size, and 
-    create a reference for the rest.
+    Label the separate regions of the level, discard the regions that
+    are smaller than a minimum size, and create a reference for the rest.
+
+    self.caves holds the offsets of each cave in (x, y) order, so the first
+    offset is the cave's first cell in a column by column scan, and caves
+    are ordered by that cell. self.caveLabels holds the index of the cave
+    of every cell, or -1 for rock and discarded regions, and
+    self.caveSets the offsets of each cave as a set.
+
+    The tiles match those of the old flood fill, but it listed the cells of
+    a cave in the order it visited them, so the exits and spawns that Map
+    picks by index into a cave land on other cells than they used to.
+    '''
+    if self.backend == 'bitboard':
+      self.getCavesBitboard()
+      return
+
+    labels, sizes = self.labelRegions()
+
+    # Offsets of the open cells, grouped by region in (x, y) order
+    xs, ys = np.nonzero(labels >= 0)
+    regions = labels[xs, ys]
+    order = np.argsort(regions, kind = 'stable')
+    offsets = np.split(xs[order] + self.mapWidth*ys[order], np.cumsum(sizes)[:-1])
+
+    # Keep the large enough regions, ordered by their first cell
+    firsts = np.unique(regions, return_index = True)[1]
+    keep = [r for r in np.argsort(firsts, kind = 'stable') if sizes[r] >= self.ROOM_MIN_SIZE]
+
+    # Fill in the discarded regions
+    index = np.full(len(sizes) + 1, -1, dtype = np.int32)
+    index[keep] = np.arange(len(keep), dtype = np.int32)
+    self.caveLabels = index[labels]
+    self.blocked[(labels >= 0) & (self.caveLabels < 0)] = True
+
+    self.caves = [offsets[r].tolist() for r in keep]
+    self.caveSets = [set(cave) for cave in self.caves]
+
+  def labelRegions(self):
+    '''
+    Label the 4-connected regions of open cells in a single pass over
+    the runs of open cells on each row, joining the runs that overlap a
+    run on the previous row with union-find. Returns an int32 grid of
+    region ids, -1 for walls, and the size of each region.
     '''
-    cave = []
-    offset = x + self.mapWidth*y
-    toBeFilled = [offset]
-    while toBeFilled:
-      offset = toBeFilled.pop()
-      
-      if offset not in cave:
-        cave.append(offset)
-        
-        xp = offset % self.mapWidth
-        yp = offset // self.mapWidth
-        self.tiles[xp][yp].blocked = True
-        
-        # Check adjacent cells
-        dx = [-1, 0, 1,  0]
-        dy = [ 0, 1, 0, -1]
-        for i in range(len(dx)):
-          xpp = xp + dx[i]
-          ypp = yp + dy[i]
-          off = xpp + self.mapWidth*ypp
-          if self.tiles[xpp][ypp].blocked == False and off not in toBeFilled and off not in cave:
-            toBeFilled.append(off)
-
-    if len(cave) >= self.ROOM_MIN_SIZE:
-      self.caves.append(cave)
+    # Runs of open cells on each row, as [start, end) columns
+    rows = np.zeros((self.mapHeight, self.mapWidth + 2), dtype = np.int8)
+    rows[:, 1:-1] = ~self.blocked.T
+    edges = np.diff(rows, axis = 1)
+    runY, runStart = np.nonzero(edges == 1)
+    runEnd = np.nonzero(edges == -1)[1]
+    rowStart = np.searchsorted(runY, np.arange(self.mapHeight + 1)).tolist()
+    roots = np.array(self.joinRuns(runStart.tolist(), runEnd.tolist(), rowStart), dtype = np.int32)
+
+    # Number the regions and paint them, run by run
+    uniqueRoots, runLabel = np.unique(roots, return_inverse = True)
+    lengths = runEnd - runStart
+    labels = np.full((self.mapHeight, self.mapWidth), -1, dtype = np.int32)
+    labels[rows[:, 1:-1].astype(bool)] = np.repeat(runLabel.astype(np.int32), lengths)
+    sizes = np.bincount(runLabel, weights = lengths, minlength = len(uniqueRoots)).astype(np.intp)
+    return np.ascontiguousarray(labels.T), sizes
+
+  def joinRuns(self, start, end, rowStart):
+    '''
+    Join the runs of open cells [start[i], end[i]) that overlap a run on
+    the previous row with union-find, where the runs of row y are
+    rowStart[y] to rowStart[y + 1]. Returns the root run of every run.
+    '''
+    parent = list(range(len(start)))
+    for y in range(1, self.mapHeight):
+      i, iEnd = rowStart[y - 1], rowStart[y]
+      j, jEnd = rowStart[y], rowStart[y + 1]
+      while i < iEnd and j < jEnd:
+        if start[i] < end[j] and start[j] < end[i]:
+          ri, rj = findRoot(parent, i), findRoot(parent, j)
+          if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+        if end[i] < end[j]:
+          i += 1
+        else:
+          j += 1
+
+    return [findRoot(parent, i) for i in range(len(parent))]
+
+  # getCaves for the bitboard backend, without NumPy
+  def getCavesBitboard(self):
+    runs = self.blocked.runs()
+    rowStart = [0]*(self.mapHeight + 1)
+    for y, x0, x1 in runs:
+      rowStart[y + 1] += 1
+    for y in range(self.mapHeight):
+      rowStart[y + 1] += rowStart[y]
+    roots = self.joinRuns([r[1] for r in runs], [r[2] for r in runs], rowStart)
+
+    # Offsets of the open cells, grouped by region
+    regions = {}
+    for (y, x0, x1), root in zip(runs, roots):
+      regions.setdefault(root, []).extend(x + self.mapWidth*y for x in range(x0, x1))
+
+    # Keep the large enough regions in (x, y) order, filling in the rest
+    caves = []
+    for region in regions.values():
+      if len(region) >= self.ROOM_MIN_SIZE:
+        caves.append(sorted(region, key = lambda o: (o % self.mapWidth, o // self.mapWidth)))
+      else:
+        for offset in region:
+          self.blocked[offset % self.mapWidth, offset // self.mapWidth] = True
+    caves.sort(key = lambda cave: (cave[0] % self.mapWidth, cave[0] // self.mapWidth))
+
+    self.caves = caves
+    self.caveSets = [set(cave) for cave in self.caves]
+    if np is not None:
+      self.caveLabels = np.full((self.mapWidth, self.mapHeight), -1, dtype = np.int32)
+      for i, cave in enumerate(self.caves):
+        offsets = np.array(cave)
+        self.caveLabels[offsets % self.mapWidth, offsets // self.mapWidth] = i
 
   # Connect the closest pairs of caves
   def connectCaves(self):
+    if self.connectMode == 'mst':
+      if np is None:
+        raise ImportError("connectMode 'mst' needs NumPy")
+      self.connectCavesMST()
+      return
+
     for i in range(len(self.caves)):
       minDistance = 1.0e9
       closest_offset = None
@@ -262,7 +600,79 @@ class CellularAutomata:
           closest_offset = offsetj
 
       if closest_offset != None:
-        self.createTunnel(closest_offset,offseti,self.caves[i])
+        self.createTunnel(closest_offset,offseti,self.caveSets[i])
+
+  def connectCavesMST(self):
+    '''
+    Connect the caves along a minimum spanning tree of tunnel lengths.
+
+    Every rock cell is assigned to its closest cave by a breadth-first
+    search grown from all caves at once. Where two regions touch, the
+    cells on either side give the closest pair of boundary cells of the
+    two caves and the shortest tunnel between them. The minimum spanning
+    tree of these candidate tunnels joins every cave with the least rock
+    carved out.
+    '''
+    owner, steps = self.growCaveRegions()
+
+    # Candidate tunnels across every touching pair of cells of different regions
+    candidates = []
+    for dx, dy in ((1, 0), (0, 1)):
+      a = (slice(0, self.mapWidth - dx), slice(0, self.mapHeight - dy))
+      b = (slice(dx, None), slice(dy, None))
+      ownerA, ownerB = owner[a], owner[b]
+      x, y = np.nonzero((ownerA >= 0) & (ownerB >= 0) & (ownerA != ownerB))
+      candidates.append((steps[a][x, y] + steps[b][x, y], ownerA[x, y], ownerB[x, y], x + self.mapWidth*y, x + dx + self.mapWidth*(y + dy)))
+    length, caveA, caveB, offsetA, offsetB = (np.concatenate(c) for c in zip(*candidates))
+
+    # Kruskal's algorithm over the candidates, shortest first
+    parent = list(range(len(self.caves)))
+    for e in np.argsort(length, kind = 'stable').tolist():
+      ra, rb = findRoot(parent, int(caveA[e])), findRoot(parent, int(caveB[e]))
+      if ra != rb:
+        parent[max(ra, rb)] = min(ra, rb)
+        self.carveToCave(int(offsetA[e]), owner, steps)
+        self.carveToCave(int(offsetB[e]), owner, steps)
+        self.tunnelSteps.append(int(length[e]))
+
+  def growCaveRegions(self):
+    '''
+    Assign every interior cell to the closest cave in 4-connected steps.
+    Returns the owning cave index of each cell, -1 where unreached, and
+    the number of steps from that cave.
+    '''
+    owner = self.caveLabels.copy()
+    steps = np.where(owner >= 0, 0, -1).astype(np.int32)
+    interior = np.zeros((self.mapWidth, self.mapHeight), dtype = bool)
+    interior[1:-1, 1:-1] = True
+    frontier = owner >= 0
+    step = 0
+    while frontier.any():
+      step += 1
+      grown = np.zeros_like(frontier)
+      for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+        # Cells reached from a frontier cell at (x - dx, y - dy)
+        src = (slice(max(0, -dx), self.mapWidth - max(0, dx)), slice(max(0, -dy), self.mapHeight - max(0, dy)))
+        dst = (slice(max(0, dx), self.mapWidth - max(0, -dx)), slice(max(0, dy), self.mapHeight - max(0, -dy)))
+        reached = frontier[src] & (owner[dst] < 0) & interior[dst]
+        owner[dst][reached] = owner[src][reached]
+        steps[dst][reached] = step
+        grown[dst] |= reached
+      frontier = grown
+    return owner, steps
+
+  # Open the cells from offset back along the region grown from its cave
+  def carveToCave(self, offset, owner, steps):
+    x = offset % self.mapWidth
+    y = offset // self.mapWidth
+    cave = owner[x, y]
+    while steps[x, y] > 0:
+      self.blocked[x, y] = False
+      for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+        if owner[x + dx, y + dy] == cave and steps[x + dx, y + dy] == steps[x, y] - 1:
+          x += dx
+          y += dy
+          break
 
   # Distance between two offsets
   def distance(self,o1,o2):
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import struct
+import tempfile
+from map.stagepack import decode_stage, encode_stage
+
+# Start of every cache file, followed by the SHA-256 digest of the payload
+MAGIC = b'RDLC2\n'
+
+# Length of the key at the start of the payload
+KEY_LENGTH = struct.Struct('<H')
+
+class LevelCache:
+  """
+  An on-disk cache of StageLayouts, one file per stage, keyed by (seed,
+  stage, width, height, generator version).
+
+  A file holds MAGIC, the digest of its payload and the payload, the repr
+  of the key followed by the stage record of map.stagepack. The payload is
+  only ever decoded as data, never unpickled, and the digest only guards
+  against corruption. A file whose digest or key does not match is
+  deleted and treated as a miss. Files are touched when read, and the least
+  recently used are evicted once the cache holds more than max_bytes.
+  """
+  def __init__(self, directory, max_bytes = 64*1024*1024):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    os.makedirs(directory, exist_ok = True)
+
+  def path(self, key):
+    name = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(self.directory, name + '.stage')
+
+  # The layout stored for key, or None
+  def get(self, key):
+    path = self.path(key)
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+    except OSError:
+      self.misses += 1
+      return None
+
+    header = len(MAGIC) + hashlib.sha256().digest_size
+    payload = data[header:]
+    layout = None
+    if data[:len(MAGIC)] == MAGIC and data[len(MAGIC):header] == hashlib.sha256(payload).digest():
+      seed, stage, width, height, version = key
+      try:
+        length, = KEY_LENGTH.unpack_from(payload)
+        start = KEY_LENGTH.size + length
+        if payload[KEY_LENGTH.size:start] == repr(key).encode():
+          layout = decode_stage(payload[start:], width, height)
+      except Exception:
+        layout = None
+
+    if layout is None:
+      self.remove(path)
+      self.misses += 1
+      return None
+
+    try:
+      os.utime(path)
+    except OSError:
+      pass
+    self.hits += 1
+    return layout
+
+  def put(self, key, layout):
+    stored_key = repr(key).encode()
+    payload = KEY_LENGTH.pack(len(stored_key)) + stored_key + encode_stage(layout)
+    data = MAGIC + hashlib.sha256(payload).digest() + payload
+
+    # Write to a temporary file first, so readers never see part of a file
+    fd, temp = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+      os.replace(temp, self.path(key))
+    except OSError:
+      self.remove(temp)
+      return
+    self.evict()
+
+  # Delete the least recently used files until the cache fits in max_bytes
+  def evict(self):
+    files = []
+    with os.scandir(self.directory) as entries:
+      for entry in entries:
+        if entry.name.endswith('.stage'):
+          try:
+            stat = entry.stat()
+          except OSError:
+            continue
+          files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for mtime, size, path in files)
+    for mtime, size, path in sorted(files):
+      if total <= self.max_bytes:
+        break
+      self.remove(path)
+      total -= size
+
+  def remove(self, path):
+    try:
+      os.remove(path)
+    except OSError:
+      pass
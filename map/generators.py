@@ -0,0 +1,160 @@
+'''
+Map generators.
+
+A generator is built as Generator(mapWidth, mapHeight, rng) with rng a
+NumPy Generator. Its generateLevel() returns a TileGrid, leaving in
+self.caves the offsets (x + mapWidth*y) of each cave in (x, y) order and
+in self.caveLabels the index of the cave of every cell, or -1, and
+settings() returns every setting that changes its output.
+
+CellularAutomata is the reference generator. The plug-ins below only
+replace how it lays out the rock, its 'fill' and 'caves' phases, and
+share the starting cavity, labeling, tunnels and smoothing with it.
+'''
+import numpy as np
+from map.ca import CellularAutomata
+
+class DrunkardsWalk(CellularAutomata):
+  '''
+  Digs caves out of solid rock with random walkers, each taking walkLength
+  steps from an open cell, until openFraction of the interior is open.
+  '''
+  def __init__(self, mapWidth, mapHeight, rng = None):
+    super().__init__(mapWidth, mapHeight, rng)
+    self.backend = 'array'
+    self.openFraction = 0.45
+    self.walkLength = 200
+
+  def settings(self):
+    return super().settings() + (self.openFraction, self.walkLength)
+
+  # Start from solid rock
+  def randomFillMap(self):
+    self.sealLevel()
+
+  def createCaves(self):
+    dx = (0, 0, 1, -1)
+    dy = (-1, 1, 0, 0)
+    target = int(self.openFraction*(self.mapWidth - 4)*(self.mapHeight - 4))
+    opened = [(self.mapWidth // 2, self.mapHeight // 2)]
+    self.blocked[opened[0]] = False
+    while len(opened) < target:
+      # Start from a random open cell, so every walk joins the caves dug so far
+      x, y = opened[int(self.rng.integers(len(opened)))]
+      for step in self.rng.integers(0, 4, self.walkLength).tolist():
+        if 2 <= x + dx[step] < self.mapWidth - 2 and 2 <= y + dy[step] < self.mapHeight - 2:
+          x += dx[step]
+          y += dy[step]
+          if self.blocked[x, y]:
+            self.blocked[x, y] = False
+            opened.append((x, y))
+
+    self.sealLevel()
+
+class BSPRooms(CellularAutomata):
+  '''
+  Splits the map into a binary space partition down to leaves of at least
+  minLeafSize cells a side, digs a room in every leaf and joins the two
+  halves of every split with an L-shaped corridor.
+  '''
+  def __init__(self, mapWidth, mapHeight, rng = None):
+    super().__init__(mapWidth, mapHeight, rng)
+    self.backend = 'array'
+    self.minLeafSize = 8
+    self.minRoomSize = 3
+
+  def settings(self):
+    return super().settings() + (self.minLeafSize, self.minRoomSize)
+
+  # Start from solid rock
+  def randomFillMap(self):
+    self.sealLevel()
+
+  def createCaves(self):
+    self.split(2, 2, self.mapWidth - 2, self.mapHeight - 2)
+    self.sealLevel()
+
+  # Dig the rooms of [x0, x1) x [y0, y1), returning the centre of one of them
+  def split(self, x0, y0, x1, y1):
+    width = x1 - x0
+    height = y1 - y0
+    vertical = width >= height
+    size = width if vertical else height
+    if size < 2*self.minLeafSize:
+      return self.dig(x0, y0, x1, y1)
+
+    cut = int(self.rng.integers(self.minLeafSize, size - self.minLeafSize + 1))
+    if vertical:
+      a = self.split(x0, y0, x0 + cut, y1)
+      b = self.split(x0 + cut, y0, x1, y1)
+    else:
+      a = self.split(x0, y0, x1, y0 + cut)
+      b = self.split(x0, y0 + cut, x1, y1)
+
+    # Corridor along x, then along y
+    self.blocked[min(a[0], b[0]):max(a[0], b[0]) + 1, a[1]] = False
+    self.blocked[b[0], min(a[1], b[1]):max(a[1], b[1]) + 1] = False
+    return a if self.rng.random() < 0.5 else b
+
+  # Dig a room inside a leaf, keeping a wall of one cell around it
+  def dig(self, x0, y0, x1, y1):
+    width = max(1, int(self.rng.integers(min(self.minRoomSize, x1 - x0 - 2), x1 - x0 - 1)))
+    height = max(1, int(self.rng.integers(min(self.minRoomSize, y1 - y0 - 2), y1 - y0 - 1)))
+    x = x0 + 1 + int(self.rng.integers(0, x1 - x0 - 1 - width))
+    y = y0 + 1 + int(self.rng.integers(0, y1 - y0 - 1 - height))
+    self.blocked[x:x + width, y:y + height] = False
+    return (x + width // 2, y + height // 2)
+
+class NoiseThreshold(CellularAutomata):
+  '''
+  Thresholds value noise, octaves of random lattices spaced scale cells
+  apart and bilinearly interpolated, so that openFraction of the interior
+  is open.
+  '''
+  def __init__(self, mapWidth, mapHeight, rng = None):
+    super().__init__(mapWidth, mapHeight, rng)
+    self.backend = 'array'
+    self.openFraction = 0.45
+    self.scale = 12
+    self.octaves = 3
+
+  def settings(self):
+    return super().settings() + (self.openFraction, self.scale, self.octaves)
+
+  # Start from solid rock
+  def randomFillMap(self):
+    self.sealLevel()
+
+  def createCaves(self):
+    inner = self.blocked[2:-2, 2:-2]
+    noise = np.zeros(inner.shape)
+    scale = float(self.scale)
+    amplitude = 1.0
+    for octave in range(self.octaves):
+      noise += amplitude*self.valueNoise(inner.shape, scale)
+      scale = max(1.0, scale/2.0)
+      amplitude /= 2.0
+
+    inner[:] = noise >= np.quantile(noise, self.openFraction)
+    self.sealLevel()
+
+  # Random values on a lattice spaced scale cells apart, interpolated over shape
+  def valueNoise(self, shape, scale):
+    lattice = self.rng.random((int(shape[0]/scale) + 2, int(shape[1]/scale) + 2))
+    x = np.arange(shape[0])/scale
+    y = np.arange(shape[1])/scale
+    x0 = x.astype(int)
+    y0 = y.astype(int)
+    fx = (x - x0)[:, None]
+    fy = (y - y0)[None, :]
+    top = lattice[x0][:, y0]*(1.0 - fx) + lattice[x0 + 1][:, y0]*fx
+    bottom = lattice[x0][:, y0 + 1]*(1.0 - fx) + lattice[x0 + 1][:, y0 + 1]*fx
+    return top*(1.0 - fy) + bottom*fy
+
+# Generators by the name Map takes
+GENERATORS = {
+  'cellular': CellularAutomata,
+  'drunkard': DrunkardsWalk,
+  'bsp': BSPRooms,
+  'noise': NoiseThreshold
+}
@@ -1,15 +1,23 @@
 import tcod as libtcod
-import random
-from map.ca import CellularAutomata
+import collections
+import hashlib
+import numpy as np
+from map.generators import GENERATORS
+from map.tile import TileGrid
+from map import scent
 from entity.ai import AI
 from entity.entity import Entity
 from entity.stats import Stats
 from item.item import Item
 from item.attribute import Attribute
 from constants import CharType, ItemType
+from rng import RNG
+
+# Bump whenever a change to the generator changes the stages it makes
+GENERATOR_VERSION = 1
 
 class Map:
-  def __init__(self, width, height, panel_height, stage):
+  def __init__(self, width, height, panel_height, stage, rng = None, generator = 'cellular'):
     # Define map width and height
     self.map_width = width
     self.map_height = 3*height
@@ -22,6 +30,16 @@ class Map:
     # Define stage
     self.stage = stage
 
+    # Random streams of this stage, taken from the RNG service: the layout of
+    # the caves, the spawns placed in them, combat rolls and creature wandering
+    if rng is None:
+      rng = RNG()
+    self.seed = rng.seed
+    self.layout_rng = rng.stream(stage, 'layout')
+    self.spawn_rng = rng.stream(stage, 'spawns')
+    self.combat_rng = rng.stream(stage, 'combat')
+    self.ai_rng = rng.stream(stage, 'ai')
+
     # Define map auto-scrolling rate
     self.elapsed = -1.0
     self.min_delay_threshold = 0.25
@@ -29,7 +47,56 @@ class Map:
     self.delta_delay_threshold = 0.25
     self.progress_yoffset = self.map_height - self.camera_height//2 - 1
 
-    self.tiles = []
+    self.tiles = TileGrid(self.map_width, self.map_height)
+
+    # Tiles that can hold the player's scent, indexed [x, y]
+    self.open_mask = np.zeros((self.map_width, self.map_height), dtype = bool)
+
+    # Scent is only simulated on the rows seen by the camera, plus a margin of
+    # rows above and below it. Rows [scent_ymin, scent_ymax) hold the live
+    # field and every other row holds no scent.
+    self.scent_margin = 0
+    self.scent_ymin = 0
+    self.scent_ymax = 0
+
+    # While the scent covers less than sparse_scent_fraction of the window,
+    # only tiles holding scent and their neighbours are updated. scent_active
+    # holds the flat indices of the non-zero tiles of current_scent and
+    # scent_stale those of previous_scent; None means they have to be rebuilt
+    # after running the dense kernel. Set sparse_scent to False to always use
+    # the dense kernel.
+    self.sparse_scent = True
+    self.sparse_scent_fraction = 0.125
+    self.scent_count = 0
+    self.scent_active = None
+    self.scent_stale = None
+
+    # In 'diffuse' mode every scent step advances the explicit diffusion. In
+    # 'steady' mode the steady-state field around the last scent_trail player
+    # positions is solved for instead, only when the player or window moves.
+    self.scent_mode = 'diffuse'
+    self.scent_trail = collections.deque(maxlen = 8)
+    self.steady_key = None
+
+    # Published once per scent step for creatures to steer by: the index of
+    # the cardinal neighbour with the most scent (see scent.CARDINAL_DX) and
+    # that neighbour's scent. Rows [gradient_ymin, gradient_ymax) are live and
+    # every other row is zero.
+    self.scent_direction = np.zeros((self.map_width, self.map_height), dtype = np.int8)
+    self.scent_max = np.zeros((self.map_width, self.map_height), dtype = np.float32)
+    self.gradient_ymin = 0
+    self.gradient_ymax = 0
+
+    # Large windows are split into bands of at least min_scent_band_rows rows
+    # and diffused by scent_threads threads
+    self.scent_threads = scent.physical_cores()
+    self.min_scent_band_rows = 256
+
+    # Scent is advanced at a fixed rate (in Hz), independent of the frame rate,
+    # with at most max_scent_ticks steps per frame to catch up after a stall
+    self.scent_rate = 20.0
+    self.scent_elapsed = 0.0
+    self.max_scent_ticks = 4
 
     # Define map generation parameters
     self.fail_limit = 50
@@ -39,13 +106,9 @@ class Map:
     self.max_equip_per_cave = 1
 
     # Create 16 unique creature symbols
-    self.creature_symbols = []
     num_create_types = 16
-    while num_create_types > 0:
-      rsym = random.randint(CharType.SPRITE_441, CharType.SPRITE_1464)
-      if rsym not in self.creature_symbols:
-        self.creature_symbols.append(rsym)
-        num_create_types -= 1
+    symbols = self.spawn_rng.choice(CharType.SPRITE_1464 - CharType.SPRITE_441 + 1, num_create_types, replace = False)
+    self.creature_symbols = (symbols + CharType.SPRITE_441).tolist()
 
     # Define common colours
     self.colours = {
@@ -54,20 +117,50 @@ class Map:
       'hole': libtcod.black
     }
 
-    self.ca = CellularAutomata(self.map_width, self.map_height)
+    # Debug overlay showing the scent as a heatmap, coloured through a lookup
+    # table from ground colour (no scent) through red to yellow (player scent)
+    self.scent_overlay = False
+    self.heatmap = self.heatmap_table(256)
 
-  def generate(self, entities, items, equips, exit):
-    player = entities[0]
+    # Generator of the cave layout, CellularAutomata or one of the plug-ins in
+    # map.generators
+    self.generator = GENERATORS[generator](self.map_width, self.map_height, self.layout_rng)
+
+    # Optional LevelCache of finished stage layouts
+    self.cache = None
 
-    # Generate tiles using Cellular Automata method
-    self.tiles = self.ca.generateLevel()
+  def generate(self, entities, items, equips, exit):
+    self.load(self.layout(), entities, items, equips, exit)
+
+  def layout(self):
+    '''
+    Generate the tiles and choose where everything is placed, without
+    creating any entities. Returns a StageLayout, which can be sent
+    between processes and is turned into the stage by load. With a cache,
+    a stage generated before is read back instead.
+    '''
+    if self.cache is not None:
+      key = (self.seed, self.stage, self.map_width, self.map_height, self.generator_version())
+      layout = self.cache.get(key)
+      if layout is not None:
+        return layout
+
+    # Generate tiles, by default using Cellular Automata method
+    tiles = self.generator.generateLevel()
 
     # Place player location and exit location
+    player = Entity(0, 0, 0, None, 'Player')
+    exit = Entity(0, 0, 0, None, 'Exit')
     self.place_player_exit(player, exit)
 
-    for c in self.ca.caves:
+    # Tiles taken by creatures, including the player, by items and by equipment
+    self.spawns = []
+    creatures = {(player.x, player.y)}
+    items = set()
+    equips = set()
+    for c in self.generator.caves:
       # Add creatures to cave
-      self.place_entities(c, player, entities)
+      self.place_entities(c, player, creatures)
 
       # Add items to cave
       self.place_items(c, player, items)
@@ -75,8 +168,40 @@ class Map:
       # Add equipment to cave
       self.place_equipment(c, player, equips)
 
+    # A level cut short by its time budget depends on the speed of the
+    # machine, so it is not stored as the stage of this seed
+    quality = self.generator.quality
+    stable = quality is None or quality['stable']
+    layout = StageLayout(self.seed, self.stage, tiles.blocked, self.generator.caveLabels, (player.x, player.y), (exit.x, exit.y), self.spawns, stable)
+    if self.cache is not None and stable:
+      self.cache.put(key, layout)
+    return layout
+
+  # Identifies the generator together with every setting that changes its output
+  def generator_version(self):
+    settings = (type(self.generator).__name__,) + self.generator.settings() + (self.fail_limit, self.spawn_avoidance, self.max_creatures_per_cave, self.max_items_per_cave, self.max_equip_per_cave)
+    return '{}-{}'.format(GENERATOR_VERSION, hashlib.sha1(repr(settings).encode()).hexdigest()[:8])
+
+  # Set up the stage from a StageLayout, adding what it spawns to the lists
+  def load(self, layout, entities, items, equips, exit):
+    player = entities[0]
+    self.tiles = TileGrid(self.map_width, self.map_height)
+    self.tiles.blocked[:] = layout.blocked()
+    self.open_mask = ~self.tiles.blocked
+
+    player.x, player.y = layout.player
+    exit.x, exit.y = layout.exit
+
+    for kind, x, y, r in layout.spawns:
+      if kind == 'creature':
+        entities.append(self.make_creature(x, y, r))
+      elif kind == 'item':
+        items.append(self.make_item(x, y, r))
+      else:
+        equips.append(self.make_equipment(x, y, r))
+
   def is_blocked(self, x, y):
-    if self.tiles[x][y].blocked or y < self.camera_yoffset or y > self.camera_height + self.camera_yoffset - 1:
+    if self.tiles.blocked[x, y] or y < self.camera_yoffset or y > self.camera_height + self.camera_yoffset - 1:
       return True
     return False
 
@@ -109,32 +234,121 @@ class Map:
 
     self.camera_yoffset = cy
 
+  # Rows of the map where scent is simulated
+  def scent_window(self):
+    ymin = max(1, self.camera_yoffset - self.scent_margin)
+    ymax = min(self.map_height - 1, self.camera_yoffset + self.camera_height + self.scent_margin)
+    return ymin, ymax
+
+  # Clear the scent on rows [ymin, ymax)
+  def drop_scent_rows(self, ymin, ymax):
+    if ymin < ymax:
+      self.tiles.previous_scent[:, ymin:ymax] = 0.0
+      self.tiles.current_scent[:, ymin:ymax] = 0.0
+
   # Update player's scent
   def update_scent(self, player):
-    dx = (-1, 0, 1, -1, 1, -1, 0, 1)
-    dy = (-1, -1, -1, 0, 0, 1, 1, 1)
-    # Diffusion coefficient
-    dcoef = 1.0/8.0
-    lamb = 1.0
+    ymin, ymax = self.scent_window()
+
+    if self.scent_mode == 'steady':
+      self.solve_scent(player, ymin, ymax)
+      self.scent_active = None
+    else:
+      self.diffuse_scent(player, ymin, ymax)
+
+    # Drop rows that left the window once they have been read for the last
+    # time, so rows entering it later start empty
+    self.drop_scent_rows(self.scent_ymin, min(self.scent_ymax, ymin))
+    self.drop_scent_rows(max(self.scent_ymin, ymax), self.scent_ymax)
+    self.scent_ymin = ymin
+    self.scent_ymax = ymax
+
+    # Publish the gradient on the rows holding scent and the row either side
+    if self.scent_active is None:
+      gmin, gmax = ymin - 1, ymax + 1
+    elif len(self.scent_active) > 0:
+      y = self.scent_active % self.map_height
+      gmin, gmax = y.min() - 1, y.max() + 2
+    else:
+      gmin, gmax = 1, 1
+    self.update_scent_gradient(max(1, gmin), min(self.map_height - 1, gmax))
+
+  # Advance the scent by one explicit diffusion step on rows [ymin, ymax)
+  def diffuse_scent(self, player, ymin, ymax):
+    # Last step's field becomes the source for this step
+    self.tiles.swap_scent()
 
     # Set the scent for the current location of the player
-    self.tiles[player.x][player.y].previous_scent = 0.75
-
-    for x in range(1, self.map_width - 1):
-      for y in range(1, self.map_height - 1):
-        if not self.is_blocked(x, y):
-          sdiff = 0.0
-          for z in range(8):
-            xp = x + dx[z]
-            yp = y + dy[z]
-            sdiff += self.tiles[xp][yp].previous_scent - self.tiles[x][y].previous_scent
-          self.tiles[x][y].current_scent = lamb*(self.tiles[x][y].previous_scent + dcoef*sdiff)
-        else:
-          self.tiles[x][y].current_scent = 0.0
-
-    for x in range(1, self.map_width - 1):
-      for y in range(1, self.map_height - 1):
-        self.tiles[x][y].previous_scent = self.tiles[x][y].current_scent
+    previous = self.tiles.previous_scent
+    previous[player.x, player.y] = scent.PLAYER_SCENT
+
+    if self.sparse_scent and self.scent_count < self.sparse_scent_fraction*(ymax - ymin)*self.map_width:
+      # Diffuse from the tiles holding scent, including the player's
+      if self.scent_active is None:
+        self.scent_active = np.flatnonzero(previous)
+        self.scent_stale = np.flatnonzero(self.tiles.current_scent)
+      source = np.append(self.scent_active, player.x*self.map_height + player.y)
+      self.scent_active = scent.diffuse_sparse(previous, self.tiles.current_scent, self.open_mask, source, self.scent_stale, ymin, ymax)
+      self.scent_stale = source
+      self.scent_count = len(self.scent_active)
+    else:
+      # Diffuse over the window and the empty row on either side of it
+      rows = slice(ymin - 1, ymax + 1)
+      nbands = min(self.scent_threads, (ymax - ymin)//self.min_scent_band_rows)
+      if nbands > 1:
+        scent.diffuse_banded(previous, self.tiles.current_scent, self.open_mask, ymin, ymax, nbands, self.scent_threads)
+      else:
+        scent.diffuse(previous[:, rows], self.tiles.current_scent[:, rows], self.open_mask[:, rows])
+      self.scent_active = None
+      if self.sparse_scent:
+        self.scent_count = np.count_nonzero(self.tiles.current_scent[:, rows] >= scent.EPSILON)
+
+    # A player outside the window leaves no scent behind
+    if player.y < ymin or player.y >= ymax:
+      previous[player.x, player.y] = 0.0
+
+  # Solve for the steady-state scent around the player's recent positions on
+  # rows [ymin, ymax), only when the player or the window has moved
+  def solve_scent(self, player, ymin, ymax):
+    if not self.scent_trail or self.scent_trail[-1] != (player.x, player.y):
+      self.scent_trail.append((player.x, player.y))
+
+    key = (player.x, player.y, ymin, ymax)
+    if key != self.steady_key:
+      sources = []
+      value = scent.PLAYER_SCENT
+      for x, y in reversed(self.scent_trail):
+        sources.append((x, y, value))
+        value *= scent.STEADY_TRAIL_DECAY
+      scent.solve_steady(self.tiles.current_scent, self.open_mask, sources, ymin, ymax)
+      self.steady_key = key
+
+  # Publish the scent gradient on rows [ymin, ymax) and clear the rows
+  # published last time that fall outside them
+  def update_scent_gradient(self, ymin, ymax):
+    if ymin < ymax:
+      scent.gradient(self.tiles.current_scent, self.scent_direction, self.scent_max, ymin, ymax)
+    for a, b in ((self.gradient_ymin, min(self.gradient_ymax, ymin)), (max(self.gradient_ymin, ymax), self.gradient_ymax)):
+      if a < b:
+        self.scent_direction[:, a:b] = 0
+        self.scent_max[:, a:b] = 0.0
+    self.gradient_ymin = ymin
+    self.gradient_ymax = ymax
+
+  # Advance the scent by as many fixed steps as the elapsed time calls for
+  def update_scent_ticks(self, player, dt):
+    period = 1.0/self.scent_rate
+    self.scent_elapsed += dt
+    ticks = 0
+    while self.scent_elapsed >= period and ticks < self.max_scent_ticks:
+      self.scent_elapsed -= period
+      self.update_scent(player)
+      ticks += 1
+
+    # Drop any backlog we could not catch up on
+    if self.scent_elapsed >= period:
+      self.scent_elapsed %= period
+    return ticks
 
   # Place player and exit in cave
   def place_player_exit(self, player, exit):
@@ -142,7 +356,7 @@ class Map:
     exit_x = None
     player_y = -1.0e10
     player_x = None
-    for c in self.ca.caves:
+    for c in self.generator.caves:
       for o in c:
         x = o % self.map_width
         y = o // self.map_width
@@ -157,226 +371,191 @@ class Map:
     player.x = player_x
     player.y = player_y
 
-  # Place creatures in cave
-  def place_entities(self, cave, player, entities):
+  # Choose a location in cave away from the player, and remove it from cave
+  def spawn_location(self, cave, player):
+    # Draw every candidate the search may need at once
+    keys = self.spawn_rng.integers(0, len(cave), self.fail_limit + 1).tolist()
+    offset = cave[keys[0]]
+    x = offset % self.map_width
+    y = offset // self.map_width
+    failcounter = 0
+    diffbest = -1
+    xbest = None
+    ybest = None
+    while((x - player.x)**2 + (y - player.y)**2 <= self.spawn_avoidance**2 and failcounter < self.fail_limit):
+      offset = cave[keys[failcounter + 1]]
+      x = offset % self.map_width
+      y = offset // self.map_width
+      diff = abs((x - player.x)**2 + (y - player.y)**2 - self.spawn_avoidance**2)
+      if diff > diffbest:
+        diffbest = diff
+        xbest = x
+        ybest = y
+      failcounter += 1
+
+    # Abort attempt if too many failures encountered
+    if failcounter >= self.fail_limit:
+      x = xbest
+      y = ybest
+      offset = x + self.map_width*y
+
+    cave.remove(offset)
+    return x, y
+
+  # Place creatures in cave, on tiles not in occupied
+  def place_entities(self, cave, player, occupied):
     # Get a random number of monsters
-    number_of_monsters = random.randint(1, self.max_creatures_per_cave)
+    number_of_monsters = int(self.spawn_rng.integers(1, self.max_creatures_per_cave + 1))
 
     for i in range(number_of_monsters):
       # Choose a random location in the cave
-      key = random.randint(0, len(cave) - 1)
-      offset = cave[key]
-      x = offset % self.map_width
-      y = offset // self.map_width
-      failcounter = 0
-      diffbest = -1
-      xbest = None
-      ybest = None
-      while((x - player.x)**2 + (y - player.y)**2 <= self.spawn_avoidance**2 and failcounter < self.fail_limit):
-        key = random.randint(0, len(cave) - 1)
-        offset = cave[key]
-        x = offset % self.map_width
-        y = offset // self.map_width
-        diff = abs((x - player.x)**2 + (y - player.y)**2 - self.spawn_avoidance**2)
-        if diff > diffbest:
-          diffbest = diff
-          xbest = x
-          ybest = y
-        failcounter += 1
-
-      # Abort attempt if too many failures encountered
-      if failcounter >= self.fail_limit:
-        x = xbest
-        y = ybest
-        offset = x + self.map_width*y
-
-      cave.remove(offset)
-
-      if not any([entity for entity in entities if entity.x == x and entity.y == y]):
-        r = random.randint(0, 100)
-        # if r < 1:
-        #   rsym = self.creature_symbols[0]
-        #   stats = Stats(hp = 30, ap = 8, dp = 5, spd = 6)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_0', stats = stats, ai = AI('creature'))
-        # elif r < 3:
-        #   rsym = self.creature_symbols[1]
-        #   stats = Stats(hp = 24, ap = 6, dp = 4, spd = 4)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_1', stats = stats, ai = AI('creature'))
-        # elif r < 4:
-        #   rsym = self.creature_symbols[2]
-        #   stats = Stats(hp = 20, ap = 5, dp = 3, spd = 3)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_2', stats = stats, ai = AI('creature'))
-        # elif r < 6:
-        #   rsym = self.creature_symbols[3]
-        #   stats = Stats(hp = 19, ap = 4, dp = 4, spd = 5)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_3', stats = stats, ai = AI('creature'))
-        # elif r < 9:
-        #   rsym = self.creature_symbols[4]
-        #   stats = Stats(hp = 18, ap = 4, dp = 4, spd = 5)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_4', stats = stats, ai = AI('creature'))
-        # elif r < 12:
-        #   rsym = self.creature_symbols[5]
-        #   stats = Stats(hp = 18, ap = 4, dp = 4, spd = 4)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_5', stats = stats, ai = AI('creature'))
-        # elif r < 15:
-        #   rsym = self.creature_symbols[6]
-        #   stats = Stats(hp = 16, ap = 4, dp = 3, spd = 4)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_6', stats = stats, ai = AI('creature'))
-        # elif r < 19:
-        #   rsym = self.creature_symbols[7]
-        #   stats = Stats(hp = 15, ap = 4, dp = 3, spd = 4)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_7', stats = stats, ai = AI('creature'))
-        # elif r < 24:
-        #   rsym = self.creature_symbols[8]
-        #   stats = Stats(hp = 15, ap = 3, dp = 2, spd = 3)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_8', stats = stats, ai = AI('creature'))
-        # elif r < 30:
-        #   rsym = self.creature_symbols[9]
-        #   stats = Stats(hp = 15, ap = 3, dp = 2, spd = 2)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_9', stats = stats, ai = AI('creature'))
-        # elif r < 37:
-        #   rsym = self.creature_symbols[10]
-        #   stats = Stats(hp = 13, ap = 3, dp = 2, spd = 3)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_10', stats = stats, ai = AI('creature'))
-        # elif r < 45:
-        #   rsym = self.creature_symbols[11]
-        #   stats = Stats(hp = 12, ap = 3, dp = 2, spd = 2)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_11', stats = stats, ai = AI('creature'))
-        # elif r < 55:
-        #   rsym = self.creature_symbols[12]
-        #   stats = Stats(hp = 11, ap = 2, dp = 2, spd = 3)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_12', stats = stats, ai = AI('creature'))
-        # elif r < 67:
-        #   rsym = self.creature_symbols[13]
-        #   stats = Stats(hp = 11, ap = 2, dp = 2, spd = 2)
-        #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_13', stats = stats, ai = AI('creature'))
-        if r < 50:
-          rsym = self.creature_symbols[14]
-          stats = Stats(hp = 10, ap = 2, dp = 1, spd = 2)
-          creature = Entity(x, y, rsym, libtcod.white, 'Creature_14', stats = stats, ai = AI('creature'))
-        else:
-          rsym = self.creature_symbols[15]
-          stats = Stats(hp = 10, ap = 1, dp = 1, spd = 2)
-          creature = Entity(x, y, rsym, libtcod.white, 'Creature_15', stats = stats, ai = AI('creature'))
-
-        entities.append(creature)
-
-  # Place items in cave
-  def place_items(self, cave, player, items):
+      x, y = self.spawn_location(cave, player)
+
+      if (x, y) not in occupied:
+        occupied.add((x, y))
+        self.spawns.append(('creature', x, y, int(self.spawn_rng.integers(0, 101))))
+
+  # Creature placed at (x, y) with roll r
+  def make_creature(self, x, y, r):
+    # if r < 1:
+    #   rsym = self.creature_symbols[0]
+    #   stats = Stats(hp = 30, ap = 8, dp = 5, spd = 6)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_0', stats = stats, ai = AI('creature'))
+    # elif r < 3:
+    #   rsym = self.creature_symbols[1]
+    #   stats = Stats(hp = 24, ap = 6, dp = 4, spd = 4)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_1', stats = stats, ai = AI('creature'))
+    # elif r < 4:
+    #   rsym = self.creature_symbols[2]
+    #   stats = Stats(hp = 20, ap = 5, dp = 3, spd = 3)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_2', stats = stats, ai = AI('creature'))
+    # elif r < 6:
+    #   rsym = self.creature_symbols[3]
+    #   stats = Stats(hp = 19, ap = 4, dp = 4, spd = 5)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_3', stats = stats, ai = AI('creature'))
+    # elif r < 9:
+    #   rsym = self.creature_symbols[4]
+    #   stats = Stats(hp = 18, ap = 4, dp = 4, spd = 5)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_4', stats = stats, ai = AI('creature'))
+    # elif r < 12:
+    #   rsym = self.creature_symbols[5]
+    #   stats = Stats(hp = 18, ap = 4, dp = 4, spd = 4)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_5', stats = stats, ai = AI('creature'))
+    # elif r < 15:
+    #   rsym = self.creature_symbols[6]
+    #   stats = Stats(hp = 16, ap = 4, dp = 3, spd = 4)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_6', stats = stats, ai = AI('creature'))
+    # elif r < 19:
+    #   rsym = self.creature_symbols[7]
+    #   stats = Stats(hp = 15, ap = 4, dp = 3, spd = 4)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_7', stats = stats, ai = AI('creature'))
+    # elif r < 24:
+    #   rsym = self.creature_symbols[8]
+    #   stats = Stats(hp = 15, ap = 3, dp = 2, spd = 3)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_8', stats = stats, ai = AI('creature'))
+    # elif r < 30:
+    #   rsym = self.creature_symbols[9]
+    #   stats = Stats(hp = 15, ap = 3, dp = 2, spd = 2)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_9', stats = stats, ai = AI('creature'))
+    # elif r < 37:
+    #   rsym = self.creature_symbols[10]
+    #   stats = Stats(hp = 13, ap = 3, dp = 2, spd = 3)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_10', stats = stats, ai = AI('creature'))
+    # elif r < 45:
+    #   rsym = self.creature_symbols[11]
+    #   stats = Stats(hp = 12, ap = 3, dp = 2, spd = 2)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_11', stats = stats, ai = AI('creature'))
+    # elif r < 55:
+    #   rsym = self.creature_symbols[12]
+    #   stats = Stats(hp = 11, ap = 2, dp = 2, spd = 3)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_12', stats = stats, ai = AI('creature'))
+    # elif r < 67:
+    #   rsym = self.creature_symbols[13]
+    #   stats = Stats(hp = 11, ap = 2, dp = 2, spd = 2)
+    #   creature = Entity(x, y, rsym, libtcod.white, 'Creature_13', stats = stats, ai = AI('creature'))
+    if r < 50:
+      rsym = self.creature_symbols[14]
+      stats = Stats(hp = 10, ap = 2, dp = 1, spd = 2)
+      creature = Entity(x, y, rsym, libtcod.white, 'Creature_14', stats = stats, ai = AI('creature'))
+    else:
+      rsym = self.creature_symbols[15]
+      stats = Stats(hp = 10, ap = 1, dp = 1, spd = 2)
+      creature = Entity(x, y, rsym, libtcod.white, 'Creature_15', stats = stats, ai = AI('creature'))
+
+    return creature
+
+  # Place items in cave, on tiles not in occupied
+  def place_items(self, cave, player, occupied):
     # Get a random number of items
-    number_of_items = random.randint(0, self.max_items_per_cave)
+    number_of_items = int(self.spawn_rng.integers(0, self.max_items_per_cave + 1))
 
     for i in range(number_of_items):
-      key = random.randint(0, len(cave) - 1)
-      offset = cave[key]
-      x = offset % self.map_width
-      y = offset // self.map_width
-      failcounter = 0
-      diffbest = -1
-      xbest = None
-      ybest = None
-      while((x - player.x)**2 + (y - player.y)**2 <= self.spawn_avoidance**2) and failcounter < self.fail_limit:
-        key = random.randint(0, len(cave) - 1)
-        offset = cave[key]
-        x = offset % self.map_width
-        y = offset // self.map_width
-        diff = abs((x - player.x)**2 + (y - player.y)**2 - self.spawn_avoidance**2)
-        if diff > diffbest:
-          diffbest = diff
-          xbest = x
-          ybest = y
-        failcounter += 1
-
-      # Abort attempt if too many failures encountered
-      if failcounter >= self.fail_limit:
-        x = xbest
-        y = ybest
-        offset = x + self.map_width*y
-
-      cave.remove(offset)
-
-      if not any([item for item in items if item.x == x and item.y == y]):
-        r = random.randint(0, 100)
-        if r < 10:
-          attr = Attribute(type = ItemType.POTION_ATK, value = 2, duration = 30.0)
-          item = Item(x, y, CharType.POTION_GREEN, libtcod.white, 'Attack Potion', attr = attr)
-        elif r < 20:
-          attr = Attribute(type = ItemType.POTION_DEF, value = 2, duration = 30.0)
-          item = Item(x, y, CharType.POTION_BLUE, libtcod.white, 'Defense Potion', attr = attr)
-        elif r < 30:
-          attr = Attribute(type = ItemType.POTION_SPD, value = 2, duration = 30.0)
-          item = Item(x, y, CharType.POTION_YELLOW, libtcod.white, 'Speed Potion', attr = attr)
-        else:
-          attr = Attribute(type = ItemType.POTION_HEAL, value = 4)
-          item = Item(x, y, CharType.POTION_RED, libtcod.white, 'Healing Potion', attr = attr)
-
-        items.append(item)
-
-  # Place equipment in cave
-  def place_equipment(self, cave, player, equips):
+      x, y = self.spawn_location(cave, player)
+
+      if (x, y) not in occupied:
+        occupied.add((x, y))
+        self.spawns.append(('item', x, y, int(self.spawn_rng.integers(0, 101))))
+
+  # Item placed at (x, y) with roll r
+  def make_item(self, x, y, r):
+    if r < 10:
+      attr = Attribute(type = ItemType.POTION_ATK, value = 2, duration = 30.0)
+      item = Item(x, y, CharType.POTION_GREEN, libtcod.white, 'Attack Potion', attr = attr)
+    elif r < 20:
+      attr = Attribute(type = ItemType.POTION_DEF, value = 2, duration = 30.0)
+      item = Item(x, y, CharType.POTION_BLUE, libtcod.white, 'Defense Potion', attr = attr)
+    elif r < 30:
+      attr = Attribute(type = ItemType.POTION_SPD, value = 2, duration = 30.0)
+      item = Item(x, y, CharType.POTION_YELLOW, libtcod.white, 'Speed Potion', attr = attr)
+    else:
+      attr = Attribute(type = ItemType.POTION_HEAL, value = 4)
+      item = Item(x, y, CharType.POTION_RED, libtcod.white, 'Healing Potion', attr = attr)
+
+    return item
+
+  # Place equipment in cave, on tiles not in occupied
+  def place_equipment(self, cave, player, occupied):
     # Get a random number of items
-    number_of_equip = random.randint(0, self.max_equip_per_cave)
+    number_of_equip = int(self.spawn_rng.integers(0, self.max_equip_per_cave + 1))
 
     for i in range(number_of_equip):
-      key = random.randint(0, len(cave) - 1)
-      offset = cave[key]
-      x = offset % self.map_width
-      y = offset // self.map_width
-      failcounter = 0
-      diffbest = -1
-      xbest = None
-      ybest = None
-      while((x - player.x)**2 + (y - player.y)**2 <= self.spawn_avoidance**2) and failcounter < self.fail_limit:
-        key = random.randint(0, len(cave) - 1)
-        offset = cave[key]
-        x = offset % self.map_width
-        y = offset // self.map_width
-        diff = abs((x - player.x)**2 + (y - player.y)**2 - self.spawn_avoidance**2)
-        if diff > diffbest:
-          diffbest = diff
-          xbest = x
-          ybest = y
-        failcounter += 1
-
-      # Abort attempt if too many failures encountered
-      if failcounter >= self.fail_limit:
-        x = xbest
-        y = ybest
-        offset = x + self.map_width*y
-
-      cave.remove(offset)
-
-      if not any([equip for equip in equips if equip.x == x and equip.y == y]):
-        r = random.randint(0, 100)
-        if r < 10:
-          stats = Stats(hp = 0, ap = 2, dp = 0, spd = 0)
-          equip = Entity(x, y, CharType.RING_RED, libtcod.white, 'Ring of Attack', stats = stats)
-        elif r < 20:
-          stats = Stats(hp = 0, ap = 0, dp = 2, spd = 0)
-          equip = Entity(x, y, CharType.RING_GREEN, libtcod.white, 'Ring of Defense', stats = stats)
-        elif r < 30:
-          stats = Stats(hp = 0, ap = 0, dp = 0, spd = 2)
-          equip = Entity(x, y, CharType.RING_BLUE, libtcod.white, 'Ring of Speed', stats = stats)
-        elif r < 40:
-          stats = Stats(hp = 0, ap = 0, dp = 1, spd = 0)
-          equip = Entity(x, y, CharType.SHIELD_BROWN, libtcod.white, 'Wooden Shield', stats = stats)
-        elif r < 50:
-          stats = Stats(hp = 0, ap = 0, dp = 2, spd = 0)
-          equip = Entity(x, y, CharType.SHIELD_GREY, libtcod.white, 'Bronze Shield', stats = stats)
-        elif r < 60:
-          stats = Stats(hp = 0, ap = 0, dp = 4, spd = 0)
-          equip = Entity(x, y, CharType.SHIELD_GOLD, libtcod.white, 'Golden Shield', stats = stats)
-        elif r < 70:
-          stats = Stats(hp = 0, ap = 1, dp = 0, spd = 0)
-          equip = Entity(x, y, CharType.SWORD_BASIC, libtcod.white, 'Bronze Sword', stats = stats)
-        elif r < 80:
-          stats = Stats(hp = 0, ap = 2, dp = 0, spd = 0)
-          equip = Entity(x, y, CharType.SWORD_STEEL, libtcod.white, 'Steel Sword', stats = stats)
-        else:
-          stats = Stats(hp = 0, ap = 4, dp = 0, spd = 0)
-          equip = Entity(x, y, CharType.SWORD_GOLD, libtcod.white, 'Golden Sword', stats = stats)
-
-        equips.append(equip)
+      x, y = self.spawn_location(cave, player)
+
+      if (x, y) not in occupied:
+        occupied.add((x, y))
+        self.spawns.append(('equipment', x, y, int(self.spawn_rng.integers(0, 101))))
+
+  # Equipment placed at (x, y) with roll r
+  def make_equipment(self, x, y, r):
+    if r < 10:
+      stats = Stats(hp = 0, ap = 2, dp = 0, spd = 0)
+      equip = Entity(x, y, CharType.RING_RED, libtcod.white, 'Ring of Attack', stats = stats)
+    elif r < 20:
+      stats = Stats(hp = 0, ap = 0, dp = 2, spd = 0)
+      equip = Entity(x, y, CharType.RING_GREEN, libtcod.white, 'Ring of Defense', stats = stats)
+    elif r < 30:
+      stats = Stats(hp = 0, ap = 0, dp = 0, spd = 2)
+      equip = Entity(x, y, CharType.RING_BLUE, libtcod.white, 'Ring of Speed', stats = stats)
+    elif r < 40:
+      stats = Stats(hp = 0, ap = 0, dp = 1, spd = 0)
+      equip = Entity(x, y, CharType.SHIELD_BROWN, libtcod.white, 'Wooden Shield', stats = stats)
+    elif r < 50:
+      stats = Stats(hp = 0, ap = 0, dp = 2, spd = 0)
+      equip = Entity(x, y, CharType.SHIELD_GREY, libtcod.white, 'Bronze Shield', stats = stats)
+    elif r < 60:
+      stats = Stats(hp = 0, ap = 0, dp = 4, spd = 0)
+      equip = Entity(x, y, CharType.SHIELD_GOLD, libtcod.white, 'Golden Shield', stats = stats)
+    elif r < 70:
+      stats = Stats(hp = 0, ap = 1, dp = 0, spd = 0)
+      equip = Entity(x, y, CharType.SWORD_BASIC, libtcod.white, 'Bronze Sword', stats = stats)
+    elif r < 80:
+      stats = Stats(hp = 0, ap = 2, dp = 0, spd = 0)
+      equip = Entity(x, y, CharType.SWORD_STEEL, libtcod.white, 'Steel Sword', stats = stats)
+    else:
+      stats = Stats(hp = 0, ap = 4, dp = 0, spd = 0)
+      equip = Entity(x, y, CharType.SWORD_GOLD, libtcod.white, 'Golden Sword', stats = stats)
+
+    return equip
 
   # Update map
   def update(self, player, dt):
@@ -385,13 +564,62 @@ class Map:
 
     self.move_camera()
 
-    self.update_scent(player)
+    self.update_scent_ticks(player, dt)
+
+  # Colour lookup table for the scent heatmap
+  def heatmap_table(self, size):
+    ground = np.array(self.colours.get('ground'), dtype = float)
+    red = np.array([200.0, 0.0, 0.0])
+    yellow = np.array([255.0, 255.0, 0.0])
+
+    # A square root ramp, so that faint trails remain visible
+    t = np.sqrt(np.linspace(0.0, 1.0, size))[:, np.newaxis]
+    low = ground + (red - ground)*np.minimum(2.0*t, 1.0)
+    table = low + (yellow - red)*np.maximum(2.0*t - 1.0, 0.0)
+    return table.astype(np.uint8)
 
   def render(self, con):
-    for y in range(self.camera_yoffset, self.camera_height + self.camera_yoffset + 1):
-      for x in range(self.camera_width):
-        wall = self.tiles[x][y].blocked
-        if wall:
-          libtcod.console_set_char_background(con, x, y - self.camera_yoffset, self.colours.get('wall'), libtcod.BKGND_SET)
-        else:
-          libtcod.console_set_char_background(con, x, y - self.camera_yoffset, self.colours.get('ground'), libtcod.BKGND_SET)
\ No newline at end of file
+    # Colour every tile visible from the camera, then write them to the
+    # console in one assignment
+    rows = slice(self.camera_yoffset, self.camera_height + self.camera_yoffset + 1)
+    blocked = self.tiles.blocked[:self.camera_width, rows]
+    if self.scent_overlay:
+      scale = (len(self.heatmap) - 1)/scent.PLAYER_SCENT
+      index = np.clip(self.tiles.current_scent[:self.camera_width, rows]*scale, 0, len(self.heatmap) - 1).astype(np.intp)
+      colours = self.heatmap[index]
+    else:
+      colours = np.empty(blocked.shape + (3,), dtype = np.uint8)
+      colours[:] = self.colours.get('ground')
+    colours[blocked] = self.colours.get('wall')
+
+    con.bg[:blocked.shape[1], :blocked.shape[0]] = colours.transpose(1, 0, 2)
+
+class StageLayout:
+  """
+  A generated stage with no tcod objects in it, small enough to send
+  between processes: the blocked mask packed to bits, the index of the
+  cave of every cell (-1 for rock), the player and exit positions, and a
+  (kind, x, y, roll) tuple for every spawn. stable is False for a level
+  whose generator ran out of time, which is not reproducible from the seed.
+  """
+  def __init__(self, seed, stage, blocked, cave_labels, player, exit, spawns, stable = True):
+    self.seed = seed
+    self.stage = stage
+    self.shape = blocked.shape
+    self.packed = np.packbits(blocked)
+    self.cave_labels = cave_labels.astype(np.int16)
+    self.player = player
+    self.exit = exit
+    self.spawns = spawns
+    self.stable = stable
+
+  # The blocked mask, indexed [x, y]
+  def blocked(self):
+    count = self.shape[0]*self.shape[1]
+    return np.unpackbits(self.packed, count = count).astype(bool).reshape(self.shape)
+
+# Generate the layout of a stage, the work done by a pre-generation worker
+def build_layout(width, height, panel_height, stage, rng, cache = None):
+  game_map = Map(width, height, panel_height, stage, rng)
+  game_map.cache = cache
+  return game_map.layout()
@@ -0,0 +1,238 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Diffusion coefficient
+DCOEF = 1.0/8.0
+
+# Decay factor applied after each diffusion step
+LAMB = 1.0
+
+# Scent deposited on the player's tile every step
+PLAYER_SCENT = 0.75
+
+# Offsets of the eight neighbours used by the stencil
+DX = (-1, 0, 1, -1, 1, -1, 0, 1)
+DY = (-1, -1, -1, 0, 0, 1, 1, 1)
+
+# Cardinal directions in the order creatures search them: north, west, south, east
+CARDINAL_DX = (0, -1, 0, 1)
+CARDINAL_DY = (-1, 0, 1, 0)
+
+def diffuse(previous, current, open_mask, dcoef = DCOEF, lamb = LAMB):
+  '''
+  Advance the scent field by one explicit diffusion step.
+
+  previous and current are (width, height) arrays indexed [x, y]. The
+  interior of current is overwritten with the 8-neighbour stencil of
+  previous, and every cell where open_mask is False is set to zero. The
+  outer ring of current is left untouched.
+  '''
+  c = previous[1:-1, 1:-1]
+  inner = current[1:-1, 1:-1]
+
+  # Sum of the eight neighbours
+  np.add(previous[:-2, :-2], previous[1:-1, :-2], out = inner)
+  inner += previous[2:, :-2]
+  inner += previous[:-2, 1:-1]
+  inner += previous[2:, 1:-1]
+  inner += previous[:-2, 2:]
+  inner += previous[1:-1, 2:]
+  inner += previous[2:, 2:]
+
+  # lamb*(c + dcoef*sum(n - c))
+  inner -= 8.0*c
+  inner *= dcoef
+  inner += c
+  inner *= lamb
+
+  # Blocked and inactive cells hold no scent
+  inner *= open_mask[1:-1, 1:-1]
+  return current
+
+def diffuse_reference(previous, current, open_mask, dcoef = DCOEF, lamb = LAMB):
+  '''
+  Pure Python version of diffuse, kept as the reference the fast kernels
+  are checked against.
+  '''
+  width = len(previous)
+  height = len(previous[0])
+  for x in range(1, width - 1):
+    for y in range(1, height - 1):
+      if open_mask[x][y]:
+        sdiff = 0.0
+        for z in range(8):
+          sdiff += previous[x + DX[z]][y + DY[z]] - previous[x][y]
+        current[x][y] = lamb*(previous[x][y] + dcoef*sdiff)
+      else:
+        current[x][y] = 0.0
+  return current
+
+def gradient(field, direction, neighbour_max, ymin, ymax):
+  '''
+  For every cell on rows [ymin, ymax), outer columns excluded, store the
+  index into CARDINAL_DX/CARDINAL_DY of the neighbour with the most scent
+  in direction, and that neighbour's scent in neighbour_max. Ties go to
+  the first direction in search order.
+  '''
+  width = field.shape[0]
+  neighbours = np.stack([field[1 + dx:width - 1 + dx, ymin + dy:ymax + dy] for dx, dy in zip(CARDINAL_DX, CARDINAL_DY)])
+  direction[1:-1, ymin:ymax] = np.argmax(neighbours, axis = 0)
+  neighbour_max[1:-1, ymin:ymax] = np.max(neighbours, axis = 0)
+
+# Cells whose scent falls below this are dropped from the sparse field
+EPSILON = 1.0e-4
+
+def diffuse_sparse(previous, current, open_mask, source, stale, ymin, ymax, epsilon = EPSILON, dcoef = DCOEF, lamb = LAMB):
+  '''
+  Sparse version of diffuse that only visits cells holding scent and
+  their neighbours.
+
+  source holds the flat indices of every non-zero cell of previous, and
+  stale those of current, which is cleared at those cells before being
+  written. Only open cells on rows [ymin, ymax) are updated, and cells
+  that end up below epsilon are dropped. Returns the flat indices of the
+  non-zero cells of current.
+  '''
+  height = previous.shape[1]
+  prev = previous.reshape(-1)
+  curr = current.reshape(-1)
+  offsets = [dx*height + dy for dx, dy in zip(DX, DY)]
+
+  # Active cells and their frontier, limited to open cells inside the window
+  cells = np.unique(np.concatenate([source] + [source + o for o in offsets]))
+  y = cells % height
+  cells = cells[(y >= ymin) & (y < ymax) & open_mask.reshape(-1)[cells]]
+
+  # lamb*(c + dcoef*sum(n - c))
+  c = prev[cells]
+  values = prev[cells + offsets[0]]
+  for o in offsets[1:]:
+    values += prev[cells + o]
+  values -= 8.0*c
+  values *= dcoef
+  values += c
+  values *= lamb
+
+  keep = values >= epsilon
+  curr[stale] = 0.0
+  curr[cells[keep]] = values[keep]
+  return cells[keep]
+
+# Thread pools shared by every map, keyed by thread count
+_pools = {}
+
+def physical_cores():
+  '''
+  Number of physical cores, read from /proc/cpuinfo where available and
+  falling back to the logical CPU count.
+  '''
+  try:
+    cores = set()
+    physical = None
+    with open('/proc/cpuinfo') as cpuinfo:
+      for line in cpuinfo:
+        if line.startswith('physical id'):
+          physical = line.split(':')[1].strip()
+        elif line.startswith('core id'):
+          cores.add((physical, line.split(':')[1].strip()))
+    if cores:
+      return len(cores)
+  except OSError:
+    pass
+  return os.cpu_count() or 1
+
+def bands(ymin, ymax, nbands):
+  '''
+  Split rows [ymin, ymax) into nbands contiguous bands of near equal size.
+  '''
+  nbands = max(1, min(nbands, ymax - ymin))
+  edges = [ymin + (ymax - ymin)*i//nbands for i in range(nbands + 1)]
+  return list(zip(edges[:-1], edges[1:]))
+
+def diffuse_banded(previous, current, open_mask, ymin, ymax, nbands, threads, dcoef = DCOEF, lamb = LAMB):
+  '''
+  Run diffuse on rows [ymin, ymax), split into horizontal bands that are
+  processed by a pool of threads.
+
+  Each band reads its own rows plus one ghost row above and below from
+  the shared previous buffer, and only writes its own rows of current, so
+  bands never touch each other's output and the result is bit-identical
+  to a single call to diffuse. NumPy releases the GIL inside the array
+  kernels, which lets the bands run in parallel.
+  '''
+  def run(band):
+    rows = slice(band[0] - 1, band[1] + 1)
+    diffuse(previous[:, rows], current[:, rows], open_mask[:, rows], dcoef, lamb)
+
+  work = bands(ymin, ymax, nbands)
+  if threads <= 1 or len(work) <= 1:
+    for band in work:
+      run(band)
+  else:
+    if threads not in _pools:
+      _pools[threads] = ThreadPoolExecutor(max_workers = threads)
+    for future in [_pools[threads].submit(run, band) for band in work]:
+      future.result()
+  return current
+
+# Decay factor of the steady-state field, the same as the explicit scheme
+STEADY_LAMB = LAMB
+
+# Scent left at a past position, relative to the one at the next position
+STEADY_TRAIL_DECAY = 0.9
+
+def _colour_slice(start, stop, shift):
+  # Every other index in [start, stop), shifted by shift
+  n = len(range(start, stop, 2))
+  return slice(start + shift, start + shift + 2*(n - 1) + 1, 2)
+
+def solve_steady(field, open_mask, sources, ymin, ymax, lamb = STEADY_LAMB, omega = 1.8, tolerance = 1.0e-4, max_iterations = 100):
+  '''
+  Relax field on rows [ymin, ymax) towards the steady state of the
+  diffusion, u = lamb*(mean of the 8 neighbours), with u held at the given
+  value on every (x, y, value) source and at zero on closed cells and
+  outside the rows.
+
+  The 8-neighbour stencil couples diagonal cells, so instead of a
+  red-black ordering the cells are swept in four colours by (x, y)
+  parity, each colour only depending on the other three, with successive
+  over-relaxation. field is used as the starting guess and updated in
+  place. Returns the number of iterations run.
+  '''
+  width = field.shape[0]
+  rows = slice(ymin - 1, ymax + 1)
+  u = field[:, rows]
+  free = open_mask[:, rows].copy()
+  free[:, 0] = False
+  free[:, -1] = False
+  u[~free] = 0.0
+  for x, y, value in sources:
+    if ymin <= y < ymax and open_mask[x, y]:
+      u[x, y - ymin + 1] = value
+      free[x, y - ymin + 1] = False
+
+  height = u.shape[1]
+  colours = []
+  for px in (1, 2):
+    for py in (1, 2):
+      if len(range(px, width - 1, 2)) > 0 and len(range(py, height - 1, 2)) > 0:
+        colours.append((px, py))
+
+  for iteration in range(1, max_iterations + 1):
+    change = 0.0
+    for px, py in colours:
+      xs = _colour_slice(px, width - 1, 0)
+      ys = _colour_slice(py, height - 1, 0)
+      total = u[_colour_slice(px, width - 1, DX[0]), _colour_slice(py, height - 1, DY[0])].copy()
+      for dx, dy in zip(DX[1:], DY[1:]):
+        total += u[_colour_slice(px, width - 1, dx), _colour_slice(py, height - 1, dy)]
+      cells = u[xs, ys]
+      delta = omega*(lamb*total/8.0 - cells)
+      delta *= free[xs, ys]
+      cells += delta
+      np.maximum(cells, 0.0, out = cells)
+      change = max(change, float(np.abs(delta).max()))
+    if change < tolerance:
+      break
+  return iteration
@@ -0,0 +1,153 @@
+'''
+Binary stage format and stage packs.
+
+A stage record is a STAGE_HEADER followed by the blocked mask at one bit
+per cell, the cave labels and one SPAWN struct per spawn. Every cave cell
+is open in the finished stage, so a label is stored for each open cell
+only, in (x, y) order, as an unsigned byte (two bytes with 255 caves or
+more) with the largest value for open cells outside every cave, and the
+labels are zlib compressed.
+
+A stage pack is a PACK_HEADER, an index of (stage, offset, length)
+entries sorted by stage, and the stage records. StagePack memory-maps a
+pack and only reads the index and the records that are asked for.
+'''
+import mmap
+import struct
+import zlib
+import numpy as np
+from map.map import StageLayout
+
+FORMAT_VERSION = 1
+PACK_MAGIC = b'RDSPACK1'
+
+# magic, format version, width, height, stage count, seed, generator version
+PACK_HEADER = struct.Struct('<8sHHHI16s16s')
+
+# stage, offset and length of a record
+INDEX = np.dtype([('stage', '<u4'), ('offset', '<u8'), ('length', '<u4')])
+
+# stage, seed, player x and y, exit x and y, cave count, bytes per label,
+# compressed label length and spawn count
+STAGE_HEADER = struct.Struct('<I16sHHHHHBIH')
+
+# kind, x, y and roll of a spawn
+SPAWN = struct.Struct('<BHHB')
+SPAWN_KINDS = ('creature', 'item', 'equipment')
+
+def seed_bytes(seed):
+  return int(seed).to_bytes(16, 'little')
+
+# Type of the stored cave labels, with itemsize bytes per label
+def label_dtype(itemsize):
+  return np.dtype('<u2') if itemsize == 2 else np.dtype(np.uint8)
+
+def encode_stage(layout):
+  '''
+  The stage record of a StageLayout, as bytes.
+  '''
+  ncaves = int(layout.cave_labels.max()) + 1
+  dtype = label_dtype(1 if ncaves < 255 else 2)
+  labels = layout.cave_labels[~layout.blocked()]
+  labels = np.where(labels < 0, np.iinfo(dtype).max, labels).astype(dtype)
+  labels = zlib.compress(labels.tobytes())
+
+  header = STAGE_HEADER.pack(layout.stage, seed_bytes(layout.seed), layout.player[0], layout.player[1],
+    layout.exit[0], layout.exit[1], ncaves, dtype.itemsize, len(labels), len(layout.spawns))
+  spawns = b''.join(SPAWN.pack(SPAWN_KINDS.index(kind), x, y, r) for kind, x, y, r in layout.spawns)
+  return header + layout.packed.tobytes() + labels + spawns
+
+def decode_stage(buffer, width, height):
+  '''
+  The StageLayout of a stage record held in buffer, for a map of the
+  given size.
+  '''
+  stage, seed, px, py, ex, ey, ncaves, itemsize, labels_length, nspawns = STAGE_HEADER.unpack_from(buffer)
+  offset = STAGE_HEADER.size
+  nbytes = (width*height + 7)//8
+  packed = np.frombuffer(buffer, dtype = np.uint8, count = nbytes, offset = offset)
+  blocked = np.unpackbits(packed, count = width*height).astype(bool).reshape(width, height)
+  offset += nbytes
+
+  dtype = label_dtype(itemsize)
+  labels = np.frombuffer(zlib.decompress(buffer[offset:offset + labels_length]), dtype = dtype)
+  offset += labels_length
+  cave_labels = np.full((width, height), -1, dtype = np.int16)
+  cave_labels[~blocked] = np.where(labels == np.iinfo(dtype).max, -1, labels.astype(np.int16))
+
+  spawns = []
+  for i in range(nspawns):
+    kind, x, y, r = SPAWN.unpack_from(buffer, offset + i*SPAWN.size)
+    spawns.append((SPAWN_KINDS[kind], x, y, r))
+
+  return StageLayout(int.from_bytes(seed, 'little'), stage, blocked, cave_labels, (px, py), (ex, ey), spawns)
+
+class PackWriter:
+  """
+  Writes a stage pack of count stages one record at a time, in any stage
+  order, so the stages never all have to be held in memory. Space for an
+  index of count entries is reserved up front, and the header and the
+  sorted index are written by close.
+  """
+  def __init__(self, path, count, width, height, seed, generator_version):
+    self.file = open(path, 'wb')
+    self.fields = (width, height, seed_bytes(seed), generator_version.encode()[:16])
+    self.index = np.zeros(count, dtype = INDEX)
+    self.count = 0
+    self.offset = PACK_HEADER.size + self.index.nbytes
+    self.file.seek(self.offset)
+
+  # Append the record of stage, made by encode_stage
+  def add(self, stage, record):
+    self.index[self.count] = (stage, self.offset, len(record))
+    self.file.write(record)
+    self.count += 1
+    self.offset += len(record)
+
+  def close(self):
+    self.index = np.sort(self.index[:self.count], order = 'stage')
+    width, height, seed, generator_version = self.fields
+    self.file.seek(0)
+    self.file.write(PACK_HEADER.pack(PACK_MAGIC, FORMAT_VERSION, width, height, self.count, seed, generator_version))
+    self.file.write(self.index.tobytes())
+    self.file.close()
+
+class StagePack:
+  """
+  A memory-mapped stage pack. Opening one only reads the header and the
+  index, and layout(stage) decodes just that stage's record.
+  """
+  def __init__(self, path):
+    self.file = open(path, 'rb')
+    self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+    magic, version, self.width, self.height, count, seed, generator_version = PACK_HEADER.unpack_from(self.data)
+    if magic != PACK_MAGIC or version != FORMAT_VERSION:
+      self.close()
+      raise ValueError('{} is not a version {} stage pack'.format(path, FORMAT_VERSION))
+    self.seed = int.from_bytes(seed, 'little')
+    self.generator_version = generator_version.rstrip(b'\0').decode()
+    self.index = np.frombuffer(self.data, dtype = INDEX, count = count, offset = PACK_HEADER.size)
+
+  def __len__(self):
+    return len(self.index)
+
+  def __contains__(self, stage):
+    i = np.searchsorted(self.index['stage'], stage)
+    return i < len(self.index) and self.index['stage'][i] == stage
+
+  # Stage numbers held in the pack
+  def stages(self):
+    return self.index['stage'].tolist()
+
+  # The StageLayout of stage, or None if the pack does not hold it
+  def layout(self, stage):
+    if stage not in self:
+      return None
+    entry = self.index[np.searchsorted(self.index['stage'], stage)]
+    start = int(entry['offset'])
+    return decode_stage(self.data[start:start + int(entry['length'])], self.width, self.height)
+
+  def close(self):
+    self.index = None
+    self.data.close()
+    self.file.close()
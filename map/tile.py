@@ -1,12 +1,93 @@
+import numpy as np
+
+class TileGrid:
+  """
+  The tiles of a map, stored as one contiguous array per field.
+  Arrays are indexed [x, y]: a bool blocked mask, the player's past and
+  present scent, and a speed modifier.
+  grid[x][y] returns a Tile view for code that works one cell at a time.
+  """
+  def __init__(self, width, height, blocked = True, speed_modifier = 1.0):
+    self.width = width
+    self.height = height
+    self.blocked = np.full((width, height), blocked, dtype = bool)
+    self.previous_scent = np.zeros((width, height), dtype = np.float32)
+    self.current_scent = np.zeros((width, height), dtype = np.float32)
+    self.speed_modifier = np.full((width, height), speed_modifier, dtype = np.float32)
+
+  def __len__(self):
+    return self.width
+
+  def __getitem__(self, x):
+    return TileColumn(self, x)
+
+  def __iter__(self):
+    for x in range(self.width):
+      yield TileColumn(self, x)
+
+  # Make the latest scent field the source for the next step
+  def swap_scent(self):
+    self.previous_scent, self.current_scent = self.current_scent, self.previous_scent
+
+class TileColumn:
+  __slots__ = ('grid', 'x')
+
+  def __init__(self, grid, x):
+    self.grid = grid
+    self.x = x
+
+  def __len__(self):
+    return self.grid.height
+
+  def __getitem__(self, y):
+    return Tile(self.grid, self.x, y)
+
+  def __iter__(self):
+    for y in range(self.grid.height):
+      yield Tile(self.grid, self.x, y)
+
 class Tile:
   """
-  A tile on a map.
+  A tile on a map, as a view into a TileGrid.
   It may or may not be blocked.
   It has the player's past and present scent value.
   It also has a speed modifier
   """
-  def __init__(self, blocked = True, speed_modifier = 1.0):
-    self.blocked = blocked
-    self.previous_scent = 0.0
-    self.current_scent = 0.0
-    self.speed_modifier = speed_modifier
\ No newline at end of file
+  __slots__ = ('grid', 'x', 'y')
+
+  def __init__(self, grid, x, y):
+    self.grid = grid
+    self.x = x
+    self.y = y
+
+  @property
+  def blocked(self):
+    return bool(self.grid.blocked[self.x, self.y])
+
+  @blocked.setter
+  def blocked(self, value):
+    self.grid.blocked[self.x, self.y] = value
+
+  @property
+  def previous_scent(self):
+    return float(self.grid.previous_scent[self.x, self.y])
+
+  @previous_scent.setter
+  def previous_scent(self, value):
+    self.grid.previous_scent[self.x, self.y] = value
+
+  @property
+  def current_scent(self):
+    return float(self.grid.current_scent[self.x, self.y])
+
+  @current_scent.setter
+  def current_scent(self, value):
+    self.grid.current_scent[self.x, self.y] = value
+
+  @property
+  def speed_modifier(self):
+    return float(self.grid.speed_modifier[self.x, self.y])
+
+  @speed_modifier.setter
+  def speed_modifier(self, value):
+    self.grid.speed_modifier[self.x, self.y] = value
@@ -0,0 +1,31 @@
+import argparse
+import numpy as np
+
+# Subsystems that draw random numbers, each from its own stream
+SUBSYSTEMS = ('layout', 'spawns', 'combat', 'ai')
+
+# Seeds are non-negative and stored in 16 bytes in stage packs
+SEED_LIMIT = 2**128
+
+# A seed given on the command line, for argparse
+def parse_seed(value):
+  seed = int(value)
+  if not 0 <= seed < SEED_LIMIT:
+    raise argparse.ArgumentTypeError('seed {} is not in [0, 2**128)'.format(value))
+  return seed
+
+class RNG:
+  """
+  Hands out independent random streams derived from a single seed, one per
+  stage and subsystem. A stream only depends on the seed, the stage and the
+  subsystem, so a stage can be generated in any process or order and a run
+  replayed from its seed. With no seed one is drawn from the OS and kept in
+  self.seed.
+  """
+  def __init__(self, seed = None):
+    self.seed = np.random.SeedSequence(seed).entropy
+
+  # A Generator for the given stage and subsystem
+  def stream(self, stage, subsystem):
+    sequence = np.random.SeedSequence(self.seed, spawn_key = (stage, SUBSYSTEMS.index(subsystem)))
+    return np.random.default_rng(sequence)
@@ -1,15 +1,23 @@
+import argparse
 import sys
 import warnings
 import time
 import tcod as libtcod
 from constants import StatusType
 from engine import Engine
+from rng import parse_seed
 
 if not sys.warnoptions:
   warnings.simplefilter("ignore")  # Prevent flood of deprecation warnings.
 
 def main():
-  engine = Engine()
+  parser = argparse.ArgumentParser(description = 'Rogue Dash')
+  parser.add_argument('--seed', type = parse_seed, default = None, help = 'seed of every run, to replay it, default a new seed for each run')
+  parser.add_argument('--cache-dir', default = None, help = 'directory of an on-disk cache of generated stages')
+  parser.add_argument('--stage-pack', default = None, help = 'stage pack to open stages from, made by bench.generate')
+  args = parser.parse_args()
+
+  engine = Engine(seed = args.seed, cache_dir = args.cache_dir, stage_pack = args.stage_pack)
 
   while not libtcod.console_is_window_closed():
     # Update all entities